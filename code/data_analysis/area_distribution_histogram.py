@@ -4,39 +4,30 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
 from scipy.signal import find_peaks
+from results_io import is_results_file, read_results, results_columns  # utils/: CSV, Parquet or Feather results
+from batch_pool import run_batch  # utils/: serial or process-pool per-file work
 
-def find_global_min_max(input_folder):
+def read_areas(csv_path):
     """
-    Scan all CSV files and find the global minimum and maximum of the transformed area data.
+    Read the drop areas of one CSV file (only the radius column is parsed).
+    Returns (csv_path, areas, min, max), or (csv_path, None, inf, -inf) without a radius column.
+    The min/max summaries merge into the global range without another read.
     """
-    min_val, max_val = np.inf, -np.inf
-    
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            if file.endswith('.csv'):
-                csv_path = os.path.join(root, file)
-                df = pd.read_csv(csv_path)
-                if 'Radius(mm)' in df.columns:
-                    data = df['Radius(mm)'].to_numpy()
-                    data = data**2 * np.pi  # Convert radius to area
-                    min_val = min(min_val, np.min(data))
-                    max_val = max(max_val, np.max(data))
-                    
-    return min_val, max_val
+    if 'Radius(mm)' not in results_columns(csv_path):
+        return csv_path, None, np.inf, -np.inf
+    radius = read_results(csv_path, columns=['Radius(mm)'])['Radius(mm)'].to_numpy()
+    data = radius**2 * np.pi  # Convert radius to area
+    if len(data) == 0:
+        return csv_path, data, np.inf, -np.inf
+    return csv_path, data, np.min(data), np.max(data)
 
-def process_csv_file(csv_path, output_folder, summary_data, bin_edges):
+def process_csv_file(csv_path, data, output_folder, bin_edges):
     """
-    Process a single CSV file with fixed binning.
+    Histogram, smooth and plot the areas of a single CSV file with fixed binning.
+    Returns the file's summary row.
     """
     os.makedirs(output_folder, exist_ok=True)
     
-    df = pd.read_csv(csv_path)
-    if 'Radius(mm)' not in df.columns:
-        raise KeyError(f"'Radius(mm)' column not found in {csv_path}. Available columns: {df.columns}")
-    
-    data = df['Radius(mm)'].to_numpy()
-    data = data**2 * np.pi  # Convert radius to area
-    
     mean_radius = np.mean(data)
     
     # Fixed binning
@@ -59,18 +50,18 @@ def process_csv_file(csv_path, output_folder, summary_data, bin_edges):
         detected_peaks = bin_centers[peaks]
     else:
         prominent_peak = np.nan
-        detected_peaks = []
+        detected_peaks = np.array([])
     
     deviation_from_peak = data - prominent_peak
     mean_deviation_from_peak = np.mean(np.abs(deviation_from_peak))
     
-    summary_data.append({
+    summary_row = {
         'File': csv_path,
         'Mean Radius': mean_radius,
         'Prominent Peak': prominent_peak,
         'Mean Deviation from Peak': mean_deviation_from_peak,
         'Detected Peaks': detected_peaks.tolist()
-    })
+    }
     
     # Plot
     plt.figure(figsize=(12, 6))
@@ -88,42 +79,62 @@ def process_csv_file(csv_path, output_folder, summary_data, bin_edges):
     plt.savefig(plot_path)
     # plt.show()
     plt.close()
+    
+    return summary_row
 
-def process_nested_folders(input_folder, output_base_folder):
+def process_nested_folders(input_folder, output_base_folder, workers=1):
     """
     Process all CSV files with fixed binning and generate summary.
+    Every file is read once: its areas are kept in memory while the global range
+    is merged from the per-file min/max, then binned from there.
+    workers > 1 reads and plots the files in a process pool; summary rows keep the file order.
     """
-    summary_data = []
+    csv_paths = []
+    for root, dirs, files in os.walk(input_folder):
+        for file in files:
+            if is_results_file(file):
+                csv_paths.append(os.path.join(root, file))
     
-    # Step 1: Find global min and max
-    global_min, global_max = find_global_min_max(input_folder)
-    print(f"Global data range: {global_min:.4f} to {global_max:.4f}")
+    # Step 1: Read every file once, merging the global min and max
+    loaded = run_batch(read_areas, [(csv_path,) for csv_path in csv_paths], workers)
     
-    # Define fixed bins
-    bin_edges = np.linspace(global_min, global_max, 150)  # 100 bins between min and max
+    global_min = min((file_min for _, _, file_min, _ in loaded), default=np.inf)
+    global_max = max((file_max for _, _, _, file_max in loaded), default=-np.inf)
     
-    # Step 2: Process each file
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            if file.endswith('.csv'):
-                csv_path = os.path.join(root, file)
-                relative_path = os.path.relpath(root, input_folder)
-                output_folder = os.path.join(output_base_folder, relative_path)
-                
-                try:
-                    process_csv_file(csv_path, output_folder, summary_data, bin_edges)
-                except KeyError as e:
-                    print(f"Skipping {csv_path}: {e}")
+    if global_min > global_max:
+        # No results files, or none with any areas: nothing to bin
+        print(f"No drop areas found in {input_folder}")
+        summary_data = []
+    else:
+        print(f"Global data range: {global_min:.4f} to {global_max:.4f}")
+        
+        # Define fixed bins
+        bin_edges = np.linspace(global_min, global_max, 150)  # 100 bins between min and max
+        
+        # Step 2: Histogram each file from its cached areas
+        jobs = []
+        for csv_path, data, _, _ in loaded:
+            if data is None:
+                print(f"Skipping {csv_path}: 'Radius(mm)' column not found")
+                continue
+            if len(data) == 0:
+                print(f"Skipping {csv_path}: no drops")
+                continue
+            relative_path = os.path.relpath(os.path.dirname(csv_path), input_folder)
+            output_folder = os.path.join(output_base_folder, relative_path)
+            jobs.append((csv_path, data, output_folder, bin_edges))
+        summary_data = run_batch(process_csv_file, jobs, workers)
     
     # Save summary
     summary_df = pd.DataFrame(summary_data)
     summary_file_path = os.path.join(output_base_folder, 'summary.csv')
     summary_df.to_csv(summary_file_path, index=False)
 
-# Set input and output folders
-input_folder = r'Input folder'
-output_folder = r'Output folder'
+if __name__ == "__main__":
+    # Set input and output folders
+    input_folder = r'Input folder'
+    output_folder = r'Output folder'
 
-process_nested_folders(input_folder, output_folder)
+    process_nested_folders(input_folder, output_folder, workers=os.cpu_count())
 
-print("Processing complete!")
\ No newline at end of file
+    print("Processing complete!")
\ No newline at end of file
@@ -1,14 +1,18 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+from results_io import read_results  # utils/: CSV, Parquet or Feather results
 
-# Load the CSV file
+# Load the results file (ellipse_fit_single output: CSV, Parquet or Feather)
 file_path = r"CSV path"
-df = pd.read_csv(file_path)
+df = read_results(file_path)
 
 # Define column names
 drop_col = "Drop number"
 angle_col = "Angle (deg)"
+major_col = "Major Axis (mm)"
+minor_col = "Minor Axis (mm)"
 
 # Select drop range
 drop_range = (1, 37)  # Adjust as needed
@@ -20,21 +24,36 @@ filtered_df = df[df[drop_col].between(drop_range[0], drop_range[1])]
 save_folder = r"C:/Users/Admin/Desktop/angle_histograms"
 os.makedirs(save_folder, exist_ok=True)  # Create folder if it doesn't exist
 
-# Plot and save histogram for each drop
-for drop_no, group in filtered_df.groupby(drop_col):
-    plt.figure(figsize=(8, 6))
-    plt.hist(group[angle_col], bins=30, alpha=0.7, color='steelblue')
-    plt.xlabel("Angle (degrees)", fontsize='large')
-    plt.ylabel("Probability Density", fontsize='large')
-    plt.title(f"Angle Histogram - Drop {drop_no}", fontsize=20)
-    plt.grid(True)
-    plt.tight_layout()
-    # plt.show()
-    
-    # Save the figure
-    # save_path = os.path.join(save_folder, f"drop_{drop_no}_angle_histogram.png")
-    # plt.savefig(save_path)
-    plt.close()  # Close the figure to avoid too many open plots
+# Per-drop angle/axis statistics in one grouped pass
+stat_cols = [col for col in (angle_col, major_col, minor_col) if col in filtered_df.columns]
+drop_stats = filtered_df.groupby(drop_col)[stat_cols].agg(['count', 'mean', 'std', 'min', 'max'])
+drop_stats.columns = [f"{col} {stat}" for col, stat in drop_stats.columns]
+drop_stats.to_csv(os.path.join(save_folder, "per_drop_stats.csv"))
+
+# Angle histograms of every drop in one call: rows = drops, columns = 30 shared angle bins
+drop_ids, drop_index = np.unique(filtered_df[drop_col].to_numpy(), return_inverse=True)
+angles = filtered_df[angle_col].to_numpy()
+angle_edges = np.linspace(angles.min(), angles.max(), 31)
+drop_counts, _, _ = np.histogram2d(drop_index, angles, bins=[np.arange(len(drop_ids) + 1) - 0.5, angle_edges])
+drop_density = drop_counts / (drop_counts.sum(axis=1, keepdims=True) * np.diff(angle_edges))
+bin_centers = (angle_edges[:-1] + angle_edges[1:]) / 2
+pd.DataFrame(drop_density, index=pd.Index(drop_ids, name=drop_col), columns=np.round(bin_centers, 3)).to_csv(
+    os.path.join(save_folder, "per_drop_angle_histograms.csv"))
+
+# Plot and save histogram for each drop (from the table above)
+save_drop_plots = False
+if save_drop_plots:
+    for drop_no, density in zip(drop_ids, drop_density):
+        plt.figure(figsize=(8, 6))
+        plt.bar(bin_centers, density, width=np.diff(angle_edges), alpha=0.7, color='steelblue')
+        plt.xlabel("Angle (degrees)", fontsize='large')
+        plt.ylabel("Probability Density", fontsize='large')
+        plt.title(f"Angle Histogram - Drop {drop_no}", fontsize=20)
+        plt.grid(True)
+        plt.tight_layout()
+        save_path = os.path.join(save_folder, f"drop_{drop_no}_angle_histogram.png")
+        plt.savefig(save_path)
+        plt.close()  # Close the figure to avoid too many open plots
 
 
 # If you want to save a **combined histogram** (all drops together), use this:
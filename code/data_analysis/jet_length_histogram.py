@@ -5,18 +5,77 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.stats import norm
+from results_io import is_results_file, read_results  # utils/: CSV, Parquet or Feather results
+from batch_pool import run_batch  # utils/: serial or process-pool per-file work
 
 def extract_flow_rate(filename):
     match = re.search(r'(\d+(?:\.\d+)?)mlpmin', filename.lower())
     return float(match.group(1)) if match else None
 
-def process_each_csv_separately(csv_folder):
-    summary_data = []
-
-    for file in glob.glob(os.path.join(csv_folder, "**/*.csv"), recursive=True):
+# Fit and plot one jet length file; returns its summary row, or None if it is skipped
+def process_jet_csv(file, flow_rate):
+    filename = os.path.basename(file)
+
+    try:
+        df = read_results(file)
+
+        if 'Jet Length (pixels)' not in df.columns:
+            print(f"Skipping '{filename}' – no 'Jet Length (pixels)' column.")
+            return None
+
+        jet_lengths = df['Jet Length (pixels)'].values
+        adjusted_lengths = jet_lengths - 11
+        valid_lengths = adjusted_lengths[adjusted_lengths > 0]
+
+        if len(valid_lengths) == 0:
+            print(f"No valid jet lengths in '{filename}' after adjustment.")
+            return None
+
+        mu, std = norm.fit(valid_lengths)
+
+        # Plotting
+        plt.figure(figsize=(8, 5))
+        plt.hist(valid_lengths, bins=40, density=True, alpha=0.6, color='b', label='Jet Lengths')
+        x = np.linspace(min(valid_lengths), max(valid_lengths), 100)
+        p = norm.pdf(x, mu, std)
+        plt.plot(x, p, 'r', linewidth=2, label=f'Fit: μ={mu:.2f}, σ={std:.2f}')
+
+        plt.xlabel('Jet Length (pixels)')
+        plt.ylabel('Density')
+        plt.title(f'Histogram: {filename}')
+        plt.legend()
+        plt.grid(True)
+
+        save_name = os.path.splitext(filename)[0] + "_histogram.png"
+        save_path = os.path.join(os.path.dirname(file), save_name)
+        plt.tight_layout()
+        plt.savefig(save_path)
+        plt.close()
+
+        print(f"[✓] Processed: {filename} (Flow Rate: {flow_rate} ml/min)")
+        print(f"    → Histogram saved to: {save_path}")
+        print(f"    → μ = {mu:.2f}, σ = {std:.2f}\n")
+
+        # Summary stats
+        return {
+            "Flow Rate (ml/min)": flow_rate,
+            "Mean (μ)": round(mu, 2),
+            "Std Dev (σ)": round(std, 2),
+            "Count": len(valid_lengths)
+        }
+
+    except Exception as e:
+        print(f"[!] Error processing '{filename}': {e}")
+        return None
+
+# workers > 1 fits and plots the files in a process pool; the summary is gathered in the same file order
+def process_each_csv_separately(csv_folder, workers=1):
+    jobs = []
+
+    for file in glob.glob(os.path.join(csv_folder, "**/*"), recursive=True):
         filename = os.path.basename(file)
 
-        if 'jet_length' not in filename.lower():
+        if not is_results_file(filename) or 'jet_length' not in filename.lower():
             continue
 
         flow_rate = extract_flow_rate(filename)
@@ -24,56 +83,9 @@ def process_each_csv_separately(csv_folder):
             print(f"[!] Could not extract flow rate from: {filename}")
             continue
 
-        try:
-            df = pd.read_csv(file)
-
-            if 'Jet Length (pixels)' not in df.columns:
-                print(f"Skipping '{filename}' – no 'Jet Length (pixels)' column.")
-                continue
-
-            jet_lengths = df['Jet Length (pixels)'].values
-            adjusted_lengths = jet_lengths - 11
-            valid_lengths = adjusted_lengths[adjusted_lengths > 0]
-
-            if len(valid_lengths) == 0:
-                print(f"No valid jet lengths in '{filename}' after adjustment.")
-                continue
-
-            mu, std = norm.fit(valid_lengths)
-
-            # Plotting
-            plt.figure(figsize=(8, 5))
-            plt.hist(valid_lengths, bins=40, density=True, alpha=0.6, color='b', label='Jet Lengths')
-            x = np.linspace(min(valid_lengths), max(valid_lengths), 100)
-            p = norm.pdf(x, mu, std)
-            plt.plot(x, p, 'r', linewidth=2, label=f'Fit: μ={mu:.2f}, σ={std:.2f}')
-
-            plt.xlabel('Jet Length (pixels)')
-            plt.ylabel('Density')
-            plt.title(f'Histogram: {filename}')
-            plt.legend()
-            plt.grid(True)
-
-            save_name = filename.replace(".csv", "_histogram.png")
-            save_path = os.path.join(os.path.dirname(file), save_name)
-            plt.tight_layout()
-            plt.savefig(save_path)
-            plt.close()
-
-            # Save summary stats
-            summary_data.append({
-                "Flow Rate (ml/min)": flow_rate,
-                "Mean (μ)": round(mu, 2),
-                "Std Dev (σ)": round(std, 2),
-                "Count": len(valid_lengths)
-            })
-
-            print(f"[✓] Processed: {filename} (Flow Rate: {flow_rate} ml/min)")
-            print(f"    → Histogram saved to: {save_path}")
-            print(f"    → μ = {mu:.2f}, σ = {std:.2f}\n")
-
-        except Exception as e:
-            print(f"[!] Error processing '{filename}': {e}")
+        jobs.append((file, flow_rate))
+
+    summary_data = [row for row in run_batch(process_jet_csv, jobs, workers) if row is not None]
 
     if summary_data:
         summary_df = pd.DataFrame(summary_data)
@@ -87,4 +99,4 @@ def process_each_csv_separately(csv_folder):
 # MAIN
 if __name__ == "__main__":
     csv_folder = r"CSV folder path"
-    process_each_csv_separately(csv_folder)
+    process_each_csv_separately(csv_folder, workers=os.cpu_count())
@@ -4,19 +4,23 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
 from scipy.signal import find_peaks
+from results_io import is_results_file, read_results  # utils/: CSV, Parquet or Feather results
+from batch_pool import run_batch  # utils/: serial or process-pool per-file work
 
-def process_csv_file(csv_path, output_folder, summary_data):
+def process_csv_file(csv_path, output_folder):
     """
     Process a single CSV file: calculate deviations from the prominent peak,
-    save processed data, generate a histogram plot, and update summary data.
+    save processed data, generate a histogram plot, and return its summary row
+    (None if the file has no 'Radius(mm)' column).
     """
     # Create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
     
     # Load data and check for 'Radius(mm)' column
-    df = pd.read_csv(csv_path)
+    df = read_results(csv_path)
     if 'Radius(mm)' not in df.columns:
-        raise KeyError(f"'Radius(mm)' column not found in {csv_path}. Available columns: {df.columns}")
+        print(f"Skipping {csv_path}: 'Radius(mm)' column not found. Available columns: {df.columns}")
+        return None
     
     # Extract radius data
     data = df['Radius(mm)'].to_numpy()
@@ -41,7 +45,7 @@ def process_csv_file(csv_path, output_folder, summary_data):
         detected_peaks = bin_centers[peaks]
     else:
         prominent_peak = np.nan  # If no peaks are detected, set prominent peak to NaN
-        detected_peaks = []
+        detected_peaks = np.array([])
     
     # Calculate deviation from the prominent peak
     df['Deviation_from_Peak'] = df['Radius(mm)'] - prominent_peak
@@ -54,14 +58,14 @@ def process_csv_file(csv_path, output_folder, summary_data):
     processed_path = os.path.join(output_folder, processed_filename)
     df.to_csv(processed_path, index=False)
     
-    # Update summary data with detected peaks and deviations
-    summary_data.append({
+    # Summary row with detected peaks and deviations
+    summary_row = {
         'File': csv_path,
         'Mean Radius': mean_radius,
         'Prominent Peak': prominent_peak,
         'Mean Deviation from Peak': mean_deviation_from_peak,
         'Detected Peaks': detected_peaks.tolist()  # Convert NumPy array to list for saving
-    })
+    }
     
     # Plot histogram and detected peaks
     plt.figure(figsize=(12, 6))
@@ -84,38 +88,41 @@ def process_csv_file(csv_path, output_folder, summary_data):
     plot_path = os.path.join(output_folder, plot_filename)
     plt.savefig(plot_path)
     plt.close()
+    
+    return summary_row
 
-def process_nested_folders(input_folder, output_base_folder):
+def process_nested_folders(input_folder, output_base_folder, workers=1):
     """
     Process all CSV files in nested folders and generate a summary file.
+    workers > 1 processes the files in a process pool; summary rows keep the file order.
     """
-    summary_data = []  # List to store summary information for all files
+    jobs = []  # (csv_path, output_folder) for every results file
     
     for root, dirs, files in os.walk(input_folder):
         for file in files:
-            if file.endswith('.csv'):  # Process only CSV files
+            if is_results_file(file):  # Process only results files
                 csv_path = os.path.join(root, file)
                 
                 # Create corresponding output subfolder
                 relative_path = os.path.relpath(root, input_folder)
                 output_folder = os.path.join(output_base_folder, relative_path)
                 
-                try:
-                    # Process the CSV file and update summary data
-                    process_csv_file(csv_path, output_folder, summary_data)
-                except KeyError as e:
-                    print(f"Skipping {csv_path}: {e}")
+                jobs.append((csv_path, output_folder))
+    
+    # Process the CSV files and gather their summary rows
+    summary_data = [row for row in run_batch(process_csv_file, jobs, workers) if row is not None]
     
     # Save summary data to a single CSV file in the output base folder
     summary_df = pd.DataFrame(summary_data)
     summary_file_path = os.path.join(output_base_folder, 'summary.csv')
     summary_df.to_csv(summary_file_path, index=False)
 
-# Set input and output folders
-input_folder = r'Input folder path'  # Replace with your input folder path containing CSVs
-output_folder = r'Output folder path'  # Replace with your desired output folder path
+if __name__ == "__main__":
+    # Set input and output folders
+    input_folder = r'Input folder path'  # Replace with your input folder path containing CSVs
+    output_folder = r'Output folder path'  # Replace with your desired output folder path
 
-# Process all CSV files in nested folders
-process_nested_folders(input_folder, output_folder)
+    # Process all CSV files in nested folders (one process per core)
+    process_nested_folders(input_folder, output_folder, workers=os.cpu_count())
 
-print("Processing complete!")
\ No newline at end of file
+    print("Processing complete!")
\ No newline at end of file
@@ -1,44 +1,49 @@
 import os
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+from results_io import is_results_file, read_results  # utils/: CSV, Parquet or Feather results
+from batch_pool import run_batch  # utils/: serial or process-pool per-file work
 
 # Function to calculate volume from radius
 def calculate_volume(radius):
     return (4/3) * np.pi * (radius ** 3)
 
-# Function to process CSV files while keeping the folder structure
-def process_csv_files(root_folder, output_folder):
+# Function to process results files while keeping the folder structure
+# workers > 1 reads and plots the files in a process pool
+def process_csv_files(root_folder, output_folder, workers=1):
+    jobs = []
     for foldername, subfolders, filenames in os.walk(root_folder):
         for filename in filenames:
-            if filename.endswith('.csv'):
-                file_path = os.path.join(foldername, filename)
+            if is_results_file(filename):
+                # Preserve folder structure in output directory
+                relative_path = os.path.relpath(foldername, root_folder)
+                jobs.append((os.path.join(foldername, filename), os.path.join(output_folder, relative_path)))
 
-                try:
-                    df = pd.read_csv(file_path)
+    run_batch(process_csv_file, jobs, workers)
 
-                    # MODIFY COLUMN NAMES HERE IF NEEDED
-                    if 'Time(Sec)' in df.columns and 'Radius(mm)' in df.columns:
-                        df.rename(columns={'Time(Sec)': 'time', 'Radius(mm)': 'radius'}, inplace=True)
-                    else:
-                        print(f"Skipping {filename}: Required columns missing")
-                        continue
+# Function to read one results file and plot its volumes
+def process_csv_file(file_path, output_subfolder):
+    filename = os.path.basename(file_path)
+    try:
+        df = read_results(file_path)
 
-                    # Calculate volume
-                    df['volume'] = calculate_volume(df['radius'])
+        # MODIFY COLUMN NAMES HERE IF NEEDED
+        if 'Time(Sec)' in df.columns and 'Radius(mm)' in df.columns:
+            df.rename(columns={'Time(Sec)': 'time', 'Radius(mm)': 'radius'}, inplace=True)
+        else:
+            print(f"Skipping {filename}: Required columns missing")
+            return
 
-                    # Preserve folder structure in output directory
-                    relative_path = os.path.relpath(foldername, root_folder)
-                    output_subfolder = os.path.join(output_folder, relative_path)
+        # Calculate volume
+        df['volume'] = calculate_volume(df['radius'])
 
-                    if not os.path.exists(output_subfolder):
-                        os.makedirs(output_subfolder)  # Create subfolders
+        os.makedirs(output_subfolder, exist_ok=True)  # Create subfolders
 
-                    # Plot and save graph
-                    plot_and_save(df, filename, output_subfolder)
+        # Plot and save graph
+        plot_and_save(df, filename, output_subfolder)
 
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
 
 # Function to plot and save images in corresponding nested folders
 def plot_and_save(df, filename, output_folder):
@@ -59,9 +64,10 @@ def plot_and_save(df, filename, output_folder):
 
     print(f"Saved plot: {image_path}")
 
-# Set your root directory containing CSV files
-root_directory = "C:/Users/Admin/Desktop/New 2/water/500fps_results/20250113/0.8mm_results"
-output_directory = "C:/Users/Admin/Desktop/New 2/water/Vol vs time scale/20250113/0.8mm_results"  # Folder to save plots
+if __name__ == "__main__":
+    # Set your root directory containing CSV files
+    root_directory = "C:/Users/Admin/Desktop/New 2/water/500fps_results/20250113/0.8mm_results"
+    output_directory = "C:/Users/Admin/Desktop/New 2/water/Vol vs time scale/20250113/0.8mm_results"  # Folder to save plots
 
-# Process and plot
-process_csv_files(root_directory, output_directory)
\ No newline at end of file
+    # Process and plot (one process per core)
+    process_csv_files(root_directory, output_directory, workers=os.cpu_count())
\ No newline at end of file
@@ -0,0 +1,26 @@
+'''Batch pool
+
+Runs the per-file work of the analysis scripts serially or in a process
+pool, returning results in input order either way.'''
+
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+
+
+def init_plot_worker():
+    '''Workers only save figures: use the non-interactive backend.'''
+    plt.switch_backend('Agg')
+
+
+def run_batch(func, jobs, workers=1):
+    '''Call func(*job) for every job and return the results in job order.
+
+    workers > 1 runs the jobs in a process pool (func must be a module-level
+    function and the script guarded by if __name__ == "__main__"). Results
+    come back in the order of jobs whatever order the workers finish in, so
+    summaries built from them are the same as a serial run's.'''
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_plot_worker) as pool:
+            return list(pool.map(func, *zip(*jobs)))
+    return [func(*job) for job in jobs]
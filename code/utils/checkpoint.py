@@ -0,0 +1,104 @@
+'''Run checkpoints
+
+Lets a long detection run be interrupted (crash, Ctrl+C, 'c'/'q' in the
+preview) and resumed where it stopped instead of starting over.'''
+
+import json
+import os
+import shutil
+from dataclasses import asdict
+
+from droplet_engine import create_tracker
+from record_buffer import RecordBuffer
+
+
+class RunCheckpoint:
+    '''Periodic on-disk checkpoint of one detection run.
+
+    Every `every` frames, save() spills the records gathered so far as .npy
+    blocks into <results_path>.parts/ and then writes
+    <results_path>.checkpoint.json with the last finished frame, the number of
+    blocks, the drop tracker's tracks and any counters the script passes.
+
+    A RunCheckpoint made later for the same results_path and config picks this
+    up: records holds the saved rows, tracker continues the saved tracks,
+    counters are restored and start_frame() gives the frame to restart from.
+    detect_drops() then seeks there and re-warms the background model on
+    warmup_frames earlier frames. finish() deletes the checkpoint once the
+    results file is written; after stop() it is kept for the next run.
+
+    spill_rows (RecordBuffer's) also spills records between checkpoints,
+    whenever that many rows are in memory (blocks beyond the saved count are rewritten on resume).'''
+
+    def __init__(self, results_path, config, every=1000, spill_rows=100_000):
+        self.path = results_path + '.checkpoint.json'
+        self.parts_dir = results_path + '.parts'
+        self.every = every
+        self.config = json.loads(json.dumps(asdict(config)))  # As it reads back from JSON
+        self.tracker = create_tracker(config)
+        self.frame_no = 0  # Last frame whose results are saved
+        self.counters = {}
+        self.stopped = False
+
+        state = self._load()
+        self.resumed = state is not None
+        if state is None:
+            # Blocks left by a run that died before its first checkpoint
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            self.records = RecordBuffer(spill_rows=spill_rows, spill_dir=self.parts_dir)
+            return
+
+        self.frame_no = state['frame']
+        self.counters = state['counters']
+        self.records = RecordBuffer.reopen(self.parts_dir, state['blocks'], spill_rows=spill_rows)
+        self.tracker.next_id = state['next_track_id']
+        self.tracker.tracks = {track_id: (cx, cy, missed) for track_id, cx, cy, missed in state['tracks']}
+        print(f"Resuming {results_path} after frame {self.frame_no} ({len(self.records)} records)")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            state = json.load(f)
+        if state['config'] != self.config:
+            raise ValueError(f"Checkpoint {self.path} was made with other detection settings; delete it to start over")
+        return state
+
+    def start_frame(self, start_frame=1):
+        '''First frame still to process.'''
+        return max(start_frame, self.frame_no + 1)
+
+    def due(self, frame_no):
+        return self.every > 0 and frame_no % self.every == 0
+
+    def save(self, frame_no, **counters):
+        '''Flush the records and record frame_no as finished.
+
+        The JSON is replaced atomically after the blocks are on disk, so a crash
+        at any point leaves the previous or the new checkpoint, never a mix.'''
+        self.records.spill()
+        self.frame_no = frame_no
+        self.counters = counters
+        state = {
+            'frame': frame_no,
+            'blocks': self.records.blocks,
+            'next_track_id': self.tracker.next_id,
+            'tracks': [[track_id, cx, cy, missed] for track_id, (cx, cy, missed) in self.tracker.tracks.items()],
+            'counters': counters,
+            'config': self.config,
+        }
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def stop(self, frame_no, **counters):
+        '''Save and keep the checkpoint: the run was stopped early on purpose.'''
+        self.save(frame_no, **counters)
+        self.stopped = True
+
+    def finish(self):
+        '''Delete the checkpoint and its blocks (get the records out first).'''
+        self.records.clear()
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,105 @@
+'''Drop crop writer
+
+Saves drop images on background threads so detection never waits on
+PNG compression or the disk.'''
+
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+
+class CropWriter:
+    '''Background writer for drop crops.
+
+    mode='png' writes one PNG per crop from `workers` threads (cv2.imwrite
+    releases the GIL, so they compress in parallel). mode='npz' packs crops
+    into archives of chunk_size crops each, named after their first crop, so
+    thousands of drops make a handful of files. Either way close() returns an
+    index of (Name, File, Key) rows locating every crop.
+
+    The queue holds at most queue_size crops, so a slow disk throttles
+    detection instead of filling memory. Names must be unique, e.g. frame
+    number plus the drop's index in that frame.
+
+    If a write fails, the first error is raised from the next save() or from
+    close(); the threads keep emptying the queue, so the caller never blocks.'''
+
+    def __init__(self, output_folder, mode='png', workers=4, queue_size=256, chunk_size=1000):
+        if mode not in ('png', 'npz'):
+            raise ValueError(f"Unknown crop mode {mode!r}, expected 'png' or 'npz'")
+        os.makedirs(output_folder, exist_ok=True)
+        self.output_folder = output_folder
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.index = []
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._pending = {}  # npz mode: crops waiting for the current archive
+        self._error = None  # First exception raised by a writer thread
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(workers if mode == 'png' else 1)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def save(self, name, image):
+        self._raise_error()
+        # Copy: the caller's image is usually a view into a frame that is about to be reused
+        self._queue.put((name, image.copy()))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # Already failed: just drain the queue
+            try:
+                self._write(*item)
+            except Exception as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+
+    def _write(self, name, image):
+        if self.mode == 'png':
+            file_name = f'drop_{name}.png'
+            if not cv2.imwrite(os.path.join(self.output_folder, file_name), image):
+                raise IOError(f"Could not write crop {os.path.join(self.output_folder, file_name)}")
+            with self._lock:
+                self.index.append((name, file_name, ''))
+        else:
+            self._pending[name] = image
+            if len(self._pending) >= self.chunk_size:
+                self._write_archive()
+
+    def _write_archive(self):
+        file_name = f'drop_crops_{next(iter(self._pending))}.npz'
+        np.savez(os.path.join(self.output_folder, file_name), **self._pending)
+        self.index.extend((name, file_name, name) for name in self._pending)
+        self._pending = {}
+
+    def close(self):
+        '''Wait for every queued crop to be written and return the index rows.'''
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._raise_error()
+        if self._pending:
+            self._write_archive()
+        return sorted(self.index)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
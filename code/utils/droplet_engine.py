@@ -0,0 +1,277 @@
+'''Droplet detection engine
+
+Shared per-frame loop used by the droplet_detection scripts:
+read -> crop -> MOG2 -> threshold -> close/open -> findContours -> moments.
+detect_drops() runs it as a generator so a script (or a batch runner) can
+consume detections frame by frame without copying the loop.'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from Functions import crop
+from frame_sources import open_video
+from tracking import CentroidTracker
+
+
+@dataclass
+class DetectionConfig:
+    '''Parameters of one detection run.
+
+    roi is given to crop() as (x_start, y_start, w_new, h_new) fractions of the frame.
+    scale is the real length (mm) of the source frame side named by scale_axis
+    ('height' or 'width', before rotation) and sets the mm/pixel ratio.
+    line_position is the counting line Y coordinate inside the ROI (pixels).
+    max_track_distance is how far (pixels) a drop may move between frames and
+    still keep its track; max_missed_frames is how long a track survives
+    without a detection.'''
+    roi: Tuple[float, float, float, float] = (0.30, 0.5, 0.38, 0.48)
+    min_contour_area: float = 100
+    max_contour_area: float = 750
+    line_position: int = 60
+    scale: float = 96  # mm
+    scale_axis: str = 'height'
+    fps: float = 500
+    rotate: Optional[int] = None  # e.g. cv2.ROTATE_90_CLOCKWISE
+    var_threshold: float = 16
+    kernel_size: int = 3
+    fit_ellipse: bool = False
+    max_track_distance: float = 40
+    max_missed_frames: int = 2
+
+
+class Drop(NamedTuple):
+    '''One accepted contour. Coordinates and sizes are in ROI pixels.'''
+    cx: int
+    cy: int
+    area: float
+    radius: float
+    track_id: int  # Persistent ID of this drop across frames
+    crossed: bool  # This drop crossed the counting line on this frame
+    contour: np.ndarray
+    ellipse: Optional[tuple]  # cv2.fitEllipse() result, if requested and possible
+
+
+class FrameDetections(NamedTuple):
+    '''Everything detect_drops() knows about one frame.'''
+    frame_no: int  # 1-based frame number in the video
+    time: float  # frame_no / fps (s)
+    ratio: float  # mm/pixel
+    drops: List[Drop]
+    crossings: int  # Drops that crossed the counting line on this frame
+    frame: np.ndarray
+    roi: np.ndarray  # View into frame
+    mask: np.ndarray
+
+
+def create_subtractor(config):
+    '''Fresh MOG2 background model for one run.'''
+    return cv2.createBackgroundSubtractorMOG2(varThreshold=config.var_threshold)
+
+
+def preview_due(det, preview_every):
+    '''True if this frame should be drawn and shown.
+
+    preview_every = 0 runs headless (no drawing, resize, imshow or waitKey at all);
+    N > 0 renders every Nth frame.'''
+    return preview_every > 0 and det.frame_no % preview_every == 0
+
+
+def mm_per_pixel(frame, config):
+    '''mm/pixel ratio from the (unrotated) source frame size.'''
+    height, width = frame.shape[:2]
+    return config.scale / (height if config.scale_axis == 'height' else width)
+
+
+def create_tracker(config):
+    '''Fresh drop tracker for one run.'''
+    return CentroidTracker(config.line_position, config.max_track_distance, config.max_missed_frames)
+
+
+def find_drops(roi, mask, config, tracker):
+    '''Contours of a cleaned mask filtered by area, with centroids, track IDs and line crossings.'''
+    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+    drops = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if not config.min_contour_area < area < config.max_contour_area:
+            continue
+
+        M = cv2.moments(cnt)
+        if M['m00'] == 0:
+            continue
+        cx = int(M['m10'] / M['m00'])
+        cy = int(M['m01'] / M['m00'])
+
+        ellipse = None
+        if config.fit_ellipse and len(cnt) >= 5:
+            ellipse = cv2.fitEllipse(cnt)
+
+        drops.append(Drop(cx, cy, area, np.sqrt(area / np.pi), 0, False, cnt, ellipse))
+
+    # Drops cross the counting line from above, judged per track
+    track_ids, crossed = tracker.update([(d.cx, d.cy) for d in drops])
+    return [d._replace(track_id=i, crossed=c) for d, i, c in zip(drops, track_ids, crossed)]
+
+
+def detect_drops(rec, config, start_frame=1, end_frame=None, warmup_frames=0, tracker=None):
+    '''Run the detection loop over rec and yield one FrameDetections per frame.
+
+    rec is anything with the cv2.VideoCapture read()/set() interface.
+    start_frame and end_frame are 1-based and inclusive.
+    warmup_frames frames before start_frame are run through the background model
+    (and the drop tracker) without being yielded, so a run that starts
+    mid-video sees the same background and line crossings as a run from frame 1.
+    Track IDs count up from 1 in every run, including the warm-up, unless an
+    existing tracker is passed to carry on (e.g. one restored from a
+    checkpoint); the warm-up then leaves it alone.'''
+    frame_no = max(1, start_frame - warmup_frames)
+    rec.set(cv2.CAP_PROP_POS_FRAMES, frame_no - 1)
+
+    obj_det = create_subtractor(config)
+    kernel = np.ones((config.kernel_size, config.kernel_size), np.uint8)
+
+    ratio = None
+    # A fresh tracker is seeded on the last warm-up frame, a given one continues as is
+    tracker_start = start_frame if tracker is not None else start_frame - 1
+    if tracker is None:
+        tracker = create_tracker(config)
+
+    while end_frame is None or frame_no <= end_frame:
+        ret, frame = rec.read()
+        if not ret:
+            break
+
+        if ratio is None:
+            ratio = mm_per_pixel(frame, config)
+
+        if config.rotate is not None:
+            frame = cv2.rotate(frame, config.rotate)
+
+        roi = crop(frame, *config.roi)
+
+        mask = obj_det.apply(roi)
+        if frame_no < tracker_start:
+            # Warm-up only needs the background model; the last warm-up frame
+            # still runs in full to seed a fresh tracker
+            frame_no += 1
+            continue
+
+        _, mask = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+        drops = find_drops(roi, mask, config, tracker)
+
+        if frame_no >= start_frame:
+            yield FrameDetections(
+                frame_no, frame_no / config.fps, ratio, drops,
+                sum(d.crossed for d in drops), frame, roi, mask
+            )
+
+        frame_no += 1
+
+
+def split_frame_range(start_frame, end_frame, chunks):
+    '''Split the inclusive range start_frame..end_frame into at most `chunks` contiguous ranges.'''
+    bounds = np.linspace(start_frame, end_frame + 1, min(chunks, end_frame - start_frame + 1) + 1).astype(int)
+    return [(int(a), int(b) - 1) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def run_chunk(video_path, config, start_frame, end_frame, warmup_frames, collect):
+    '''Open video_path and return collect(detections) for one frame range.
+
+    Also returns the chunk's track IDs: the ones seen in the range, those on its
+    first frame and those on the frame after it (read but not passed to collect),
+    which is what stitch_track_ids() needs to join chunks.'''
+    cv2.setNumThreads(1)
+    rec = open_video(video_path)
+    tracks = {'ids': set(), 'first': [], 'next': []}
+
+    def frames():
+        for det in detect_drops(rec, config, start_frame, end_frame + 1, warmup_frames):
+            centroids = [(d.track_id, d.cx, d.cy) for d in det.drops]
+            if det.frame_no > end_frame:
+                tracks['next'] = centroids
+                return
+            if det.frame_no == start_frame:
+                tracks['first'] = centroids
+            tracks['ids'].update(d.track_id for d in det.drops)
+            yield det
+
+    try:
+        return collect(frames()), tracks
+    finally:
+        rec.release()
+
+
+def stitch_track_ids(chunk_tracks, max_offset=3):
+    '''Map every chunk's local track IDs onto one numbering for the whole video.
+
+    A drop on a chunk's first frame continues the track of the previous chunk's
+    drop at the same position on that same frame; all other tracks get new IDs
+    in order of appearance, as a sequential run would number them.
+    Returns one {local ID: global ID} dict per chunk.
+
+    The numbering equals a sequential run's only when every chunk's drops
+    near its start match the sequential ones, i.e. with run_chunked()'s
+    default warm-up. With a shorter warm-up, a drop that is missed or moved
+    on a chunk's first frame starts a new track, and every later ID shifts.'''
+    id_maps = []
+    next_id = 1
+    previous = None
+    for tracks in chunk_tracks:
+        id_map = {}
+        if previous is not None:
+            prev_map, prev_next = previous
+            for track_id, cx, cy in tracks['first']:
+                candidates = [
+                    (abs(cx - px) + abs(cy - py), prev_id) for prev_id, px, py in prev_next
+                    if abs(cx - px) + abs(cy - py) <= max_offset and prev_id in prev_map
+                ]
+                if candidates:
+                    id_map[track_id] = prev_map[min(candidates)[1]]
+        for track_id in sorted(tracks['ids']):
+            if track_id not in id_map:
+                id_map[track_id] = next_id
+                next_id += 1
+        id_maps.append(id_map)
+        previous = id_map, tracks['next']
+    return id_maps
+
+
+def run_chunked(video_path, config, collect, start_frame=1, end_frame=None,
+                workers=None, warmup_frames=2000):
+    '''Process one video as parallel frame ranges.
+
+    The range is split into one chunk per worker; each chunk warms up a fresh
+    background model on the warmup_frames frames before it and hands its
+    detections to collect(), which must be a picklable (module-level) function
+    returning something small, e.g. rows for a DataFrame. Returns
+    (collect() result, {local track ID: global track ID}) per chunk in frame
+    order; track IDs inside a chunk are local and must be mapped.
+
+    MOG2 learns with rate 1/min(frames seen, history) and only slowly forgets
+    older frames, so a chunk's model matches the sequential one only once the
+    warm-up reaches well past the subtractor history (500 by default). The
+    default, about 4x the history, reproduced the sequential drops, crossings,
+    counts and track numbering in tests. A warm-up of just the history is
+    faster but only approximates them: near chunk starts a detection can be
+    missed or a centroid move by a pixel, which can also split a track.'''
+    workers = workers or os.cpu_count()
+    if end_frame is None:
+        rec = open_video(video_path, prefetch=0)
+        end_frame = int(rec.get(cv2.CAP_PROP_FRAME_COUNT))
+        rec.release()
+
+    ranges = split_frame_range(start_frame, end_frame, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_chunk, video_path, config, a, b, warmup_frames, collect) for a, b in ranges]
+        results = [future.result() for future in futures]
+
+    id_maps = stitch_track_ids([tracks for _, tracks in results])
+    return [(result, id_map) for (result, _), id_map in zip(results, id_maps)]
@@ -0,0 +1,252 @@
+'''Frame sources
+
+Readers with the cv2.VideoCapture interface (read/set/get/isOpened/release)
+that the detection engine can consume. Besides videos, TIFF stacks and
+folders of images are read directly, with no conversion to AVI first.'''
+
+import os
+import queue
+import re
+import threading
+
+import cv2
+import tifffile
+
+from tiff_stack import TiffStack
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+IMAGE_EXTENSIONS = ('.png', '.tif', '.tiff', '.bmp', '.jpg', '.jpeg')
+
+
+class PrefetchReader:
+    '''Wrap a capture and decode frames ahead on a background thread.
+
+    Decoded frames wait in a bounded queue, so decoding overlaps with the
+    processing of earlier frames (OpenCV releases the GIL while it decodes)
+    and memory stays at buffer_size frames whatever the video length.
+
+    release() (or leaving a with block) stops the decode thread; call it even
+    when processing fails, or the thread keeps the capture and its frames.
+    An exception raised while decoding (e.g. a corrupt TIFF page) is raised
+    again from read() instead of ending the thread silently.'''
+
+    def __init__(self, rec, buffer_size=64):
+        self.rec = rec
+        self.buffer_size = buffer_size
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._exhausted = False
+
+    def _decode(self):
+        while not self._stop.is_set():
+            try:
+                ret, frame = self.rec.read()
+            except cv2.error:
+                ret, frame = False, None  # As a plain capture: the video ends here
+            except Exception as e:
+                ret, frame = False, e  # Handed to read(), which raises it
+            self._put((ret, frame))
+            if not ret:
+                return
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=self.buffer_size)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+        self._thread.start()
+
+    def _halt(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._queue = None  # Drop frames decoded ahead
+        self._exhausted = False
+
+    def read(self):
+        if self._exhausted:
+            return False, None
+        if self._thread is None:
+            self._start()
+        while True:
+            try:
+                ret, frame = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                # A thread that died without queuing its end marker would leave us waiting forever
+                if not self._thread.is_alive() and self._queue.empty():
+                    ret, frame = False, None
+                    break
+        if not ret:
+            self._exhausted = True
+            if isinstance(frame, Exception):
+                raise frame
+            frame = None
+        return ret, frame
+
+    def set(self, prop, value):
+        # Seeking invalidates everything already decoded
+        self._halt()
+        return self.rec.set(prop, value)
+
+    def get(self, prop):
+        return self.rec.get(prop)
+
+    def isOpened(self):
+        return self.rec.isOpened()
+
+    def release(self):
+        self._halt()
+        self.rec.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class TiffReader:
+    '''Multi-page TIFF stack read like a video.
+
+    Frames come from TiffStack (memory-mapped when possible, 12/16-bit data
+    scaled by normalize) as 2-D grayscale with gray=True, else BGR.
+    TIFFs carry no frame rate, so CAP_PROP_FPS reports the fps given here.'''
+
+    def __init__(self, path, gray=False, normalize='global', fps=0):
+        self.stack = TiffStack(path, normalize=normalize)
+        self.gray = gray
+        self.fps = fps
+        self._pos = 0
+        self._block_start = None
+        self._block = None
+
+    def read(self):
+        if self.stack is None or self._pos >= len(self.stack):
+            return False, None
+        start = self._pos - self._pos % self.stack.block_size
+        if start != self._block_start:
+            self._block = self.stack.uint8_block(start)
+            self._block_start = start
+        frame = self._block[self._pos - start]
+        self._pos += 1
+        if frame.ndim == 3:
+            return True, cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY if self.gray else cv2.COLOR_RGB2BGR)
+        # Copy: the block buffer is reused for the next block
+        return True, frame.copy() if self.gray else cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self._pos = max(0, int(value))
+        return True
+
+    def get(self, prop):
+        height, width = self.stack.frame_shape[:2]
+        return {
+            cv2.CAP_PROP_FRAME_COUNT: len(self.stack), cv2.CAP_PROP_POS_FRAMES: self._pos,
+            cv2.CAP_PROP_FRAME_WIDTH: width, cv2.CAP_PROP_FRAME_HEIGHT: height, cv2.CAP_PROP_FPS: self.fps,
+        }.get(prop, 0)
+
+    def isOpened(self):
+        return self.stack is not None
+
+    def release(self):
+        if self.stack is not None:
+            self.stack.close()
+            self.stack = None
+
+
+class ImageFolderReader:
+    '''Folder of image files (one frame each) read like a video.
+
+    Files are taken in natural order (frame2 before frame10). 16-bit images
+    are reduced to 8 bits by OpenCV when read.'''
+
+    def __init__(self, folder, gray=False, fps=0):
+        def natural_key(name):
+            return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+        self.files = [
+            os.path.join(folder, name) for name in sorted(os.listdir(folder), key=natural_key)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        self.flags = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+        self.fps = fps
+        self._pos = 0
+        self._shape = None
+
+    def read(self):
+        if self._pos >= len(self.files):
+            return False, None
+        frame = cv2.imread(self.files[self._pos], self.flags)
+        self._pos += 1
+        return frame is not None, frame
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self._pos = max(0, int(value))
+        return True
+
+    def get(self, prop):
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            if self._shape is None:
+                self._shape = cv2.imread(self.files[0], self.flags).shape
+            return self._shape[1] if prop == cv2.CAP_PROP_FRAME_WIDTH else self._shape[0]
+        return {cv2.CAP_PROP_FRAME_COUNT: len(self.files), cv2.CAP_PROP_POS_FRAMES: self._pos,
+                cv2.CAP_PROP_FPS: self.fps}.get(prop, 0)
+
+    def isOpened(self):
+        return len(self.files) > 0
+
+    def release(self):
+        self.files = []
+
+
+def is_frame_source(path):
+    '''True for a TIFF stack or a folder of images that open_video() reads directly.
+
+    A folder counts as one recording when it holds image files that are single
+    frames; a folder of multi-page TIFF stacks holds several recordings instead.'''
+    if not os.path.isdir(path):
+        return path.lower().endswith(TIFF_EXTENSIONS)
+    images = [name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    tiffs = [name for name in images if name.lower().endswith(TIFF_EXTENSIONS)]
+    if not images:
+        return False
+    if not tiffs:
+        return True
+    with tifffile.TiffFile(os.path.join(path, tiffs[0])) as tif:
+        try:
+            tif.pages[1]  # Reads only the second page's header
+        except IndexError:
+            return True  # Single-page TIFFs: an image sequence
+    return False
+
+
+def open_video(video_path, prefetch=64, gray=False, normalize='global'):
+    '''Open a video for detect_drops(); prefetch > 0 decodes that many frames ahead.
+
+    video_path may also be a multi-page TIFF stack (12/16-bit data scaled as
+    TiffStack's normalize) or a folder of images.
+    gray=True gives 2-D grayscale frames for TIFF stacks and image folders;
+    videos always decode to BGR (FFMPEG's planar luma output is an unsupported
+    format that OpenCV warns about on every frame), so convert those after
+    cropping.'''
+    if os.path.isdir(video_path):
+        rec = ImageFolderReader(video_path, gray)
+    elif video_path.lower().endswith(TIFF_EXTENSIONS):
+        rec = TiffReader(video_path, gray, normalize)
+    else:
+        rec = cv2.VideoCapture(video_path)
+    return PrefetchReader(rec, prefetch) if prefetch > 0 else rec
@@ -0,0 +1,61 @@
+'''Processed-file manifest
+
+Remembers which inputs a batch script has already handled, so a rerun only
+processes new or changed files.'''
+
+import json
+import os
+
+
+class ProcessedManifest:
+    '''JSON record of processed inputs, kept next to the outputs.
+
+    Each input is stored with its size and modification time, the outputs it
+    produced and any extra info (e.g. counts for a report). is_current() is
+    True when the input is unchanged, every output still exists and is newer
+    than the input, and params (the settings that shape the outputs) are the
+    same as when it was processed. Size + mtime is used instead of a content
+    hash, which would mean reading every video in full on every run.'''
+
+    def __init__(self, path, params=None):
+        self.path = path
+        self.params = json.loads(json.dumps(params or {}))  # As it reads back from JSON
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def _key(input_path):
+        return os.path.normcase(os.path.abspath(input_path))
+
+    def is_current(self, input_path):
+        entry = self.entries.get(self._key(input_path))
+        if entry is None or entry['params'] != self.params:
+            return False
+        stat = os.stat(input_path)
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            return False
+        return all(os.path.exists(out) and os.path.getmtime(out) >= stat.st_mtime for out in entry['outputs'])
+
+    def info(self, input_path):
+        '''Extra info stored by mark_done() for this input.'''
+        return self.entries[self._key(input_path)]['info']
+
+    def mark_done(self, input_path, outputs, **info):
+        '''Record input_path as processed into outputs and save the manifest.'''
+        stat = os.stat(input_path)
+        self.entries[self._key(input_path)] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'params': self.params,
+            'outputs': [os.path.abspath(out) for out in outputs],
+            'info': info,
+        }
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(self.path + '.tmp', self.path)
@@ -0,0 +1,173 @@
+'''Drop record buffer
+
+Typed, preallocated storage for per-drop measurements, replacing lists of
+small Python lists. Rows live in a structured NumPy array that grows by
+doubling; with a spill folder, full blocks are written to .npy files so
+memory stays bounded however long the recording is.'''
+
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+from results_io import write_results_chunks
+
+DROP_RECORD = np.dtype([
+    ('frame', np.int64),
+    ('time', np.float64),  # s
+    ('track_id', np.int64),
+    ('x', np.float64),  # mm
+    ('y', np.float64),  # mm
+    ('radius', np.float64),  # mm, from the contour area
+    ('major_axis', np.float64),  # mm, NaN without an ellipse fit
+    ('minor_axis', np.float64),  # mm, NaN without an ellipse fit
+    ('angle', np.float64),  # deg, NaN without an ellipse fit
+    ('crossed', np.bool_),  # Crossed the counting line on this frame
+])
+
+
+class RecordBuffer:
+    '''Growable structured array of DROP_RECORD rows.
+
+    capacity is the initial number of rows. Every block of spill_rows rows
+    is saved to spill_dir (a temporary folder by default) and dropped from
+    memory, so hour-long recordings stay bounded; spill_rows=None keeps
+    everything in memory. chunks(), frames(), write_results() and the
+    column statistics walk the blocks one at a time; to_array()/to_frame()
+    read everything back into memory, so use them only for small buffers.
+    A temporary spill folder is deleted by clear() or when the buffer is
+    garbage collected.'''
+
+    def __init__(self, capacity=4096, spill_rows=100_000, spill_dir=None):
+        self._data = np.empty(capacity, DROP_RECORD)
+        self._size = 0
+        self.spill_rows = spill_rows
+        self.spill_dir = spill_dir
+        self._spilled = []  # Paths of spilled blocks, in order
+        self._spilled_rows = 0
+        self._cleanup = None  # Deletes a temporary spill folder
+
+    @classmethod
+    def reopen(cls, spill_dir, blocks, capacity=4096, spill_rows=100_000):
+        '''Buffer continuing the first `blocks` blocks an earlier buffer spilled to spill_dir.'''
+        buffer = cls(capacity, spill_rows, spill_dir)
+        for i in range(blocks):
+            path = buffer._block_path(i)
+            buffer._spilled.append(path)
+            buffer._spilled_rows += len(np.load(path, mmap_mode='r'))
+        return buffer
+
+    def __len__(self):
+        return self._spilled_rows + self._size
+
+    @property
+    def blocks(self):
+        '''Number of blocks spilled to disk so far.'''
+        return len(self._spilled)
+
+    def append(self, frame, time, track_id, x, y, radius,
+               major_axis=np.nan, minor_axis=np.nan, angle=np.nan, crossed=False):
+        if self._size == len(self._data):
+            self._grow()
+        self._data[self._size] = (frame, time, track_id, x, y, radius, major_axis, minor_axis, angle, crossed)
+        self._size += 1
+        if self.spill_rows and self._size >= self.spill_rows:
+            self.spill()
+
+    def add_drop(self, det, drop):
+        '''Append one Drop of a FrameDetections, converted to mm.
+
+        x/y are the fitted ellipse centre when there is one, else the centroid.'''
+        ratio = det.ratio
+        if drop.ellipse is not None:
+            (xc, yc), (major_axis, minor_axis), angle = drop.ellipse
+            self.append(det.frame_no, det.time, drop.track_id, xc * ratio, yc * ratio, drop.radius * ratio,
+                        major_axis * ratio, minor_axis * ratio, angle, drop.crossed)
+        else:
+            self.append(det.frame_no, det.time, drop.track_id, drop.cx * ratio, drop.cy * ratio,
+                        drop.radius * ratio, crossed=drop.crossed)
+
+    def _grow(self):
+        grown = np.empty(2 * max(len(self._data), 1), DROP_RECORD)
+        grown[:self._size] = self._data[:self._size]
+        self._data = grown
+
+    def _block_path(self, i):
+        return os.path.join(self.spill_dir, f'block_{i:05d}.npy')
+
+    def spill(self):
+        '''Move the rows held in memory to a .npy block on disk.'''
+        if not self._size:
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='drop_records_')
+            self._cleanup = weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = self._block_path(len(self._spilled))
+        np.save(path, self._data[:self._size])
+        self._spilled.append(path)
+        self._spilled_rows += self._size
+        self._size = 0
+
+    def chunks(self):
+        '''Yield the rows block by block (spilled blocks memory-mapped), oldest first.'''
+        for path in self._spilled:
+            yield np.load(path, mmap_mode='r')
+        if self._size:
+            yield self._data[:self._size]
+
+    def frames(self, columns):
+        '''Yield a DataFrame per block, columns mapping field name -> column title.'''
+        for chunk in self.chunks():
+            yield pd.DataFrame({title: chunk[field] for field, title in columns.items()})
+
+    def write_results(self, path, columns, float_format='%.4f'):
+        '''Write the rows to a results file block by block (see results_io).'''
+        write_results_chunks(self.frames(columns), path, list(columns.values()), float_format)
+
+    def column(self, field, where=None):
+        '''One field of every row (of the rows whose bool field `where` is set) as an array.'''
+        parts = [chunk[field][chunk[where]] if where else chunk[field] for chunk in self.chunks()]
+        return np.concatenate(parts) if parts else np.empty(0, DROP_RECORD[field])
+
+    def mean(self, field):
+        '''Mean of a field over every row, NaN when empty.'''
+        total = sum(chunk[field].sum() for chunk in self.chunks())
+        return total / len(self) if len(self) else np.nan
+
+    def histogram(self, field, bins=100, range=None):
+        '''(counts, edges) of a field, as np.histogram over all rows, built block by block.'''
+        if range is None:
+            if len(self):
+                range = (min(chunk[field].min() for chunk in self.chunks() if len(chunk)),
+                         max(chunk[field].max() for chunk in self.chunks() if len(chunk)))
+            else:
+                range = (0, 1)
+        # Same bins and range for every block, so the counts add up exactly
+        counts = np.zeros(bins, np.int64)
+        edges = np.histogram_bin_edges([], bins, range)
+        for chunk in self.chunks():
+            counts += np.histogram(chunk[field], bins, range)[0]
+        return counts, edges
+
+    def to_array(self):
+        return np.concatenate(list(self.chunks())) if len(self) else self._data[:0].copy()
+
+    def to_frame(self, columns):
+        '''DataFrame of the given fields, columns mapping field name -> column title.'''
+        data = self.to_array()
+        return pd.DataFrame({title: data[field] for field, title in columns.items()})
+
+    def clear(self):
+        '''Forget every row, deleting spilled blocks.'''
+        for path in self._spilled:
+            os.remove(path)
+        self._spilled = []
+        self._spilled_rows = 0
+        self._size = 0
+        if self._cleanup is not None:
+            self._cleanup()
+            self.spill_dir = None
+            self._cleanup = None
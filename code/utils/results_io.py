@@ -0,0 +1,91 @@
+'''Results files
+
+Detector outputs can be written as CSV (the default) or as typed columnar
+Parquet/Feather files (needs pyarrow). The analysis scripts read any of
+them through read_results(), picking the format from the extension.'''
+
+import os
+
+import pandas as pd
+
+RESULT_FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+
+def is_results_file(file_name):
+    '''True for files read_results() can load.'''
+    return os.path.splitext(file_name)[1].lower() in RESULT_FORMATS.values()
+
+
+def write_results(df, path, float_format='%.4f'):
+    '''Write df in the format given by path's extension.
+
+    Only CSV is rounded (float_format); Parquet and Feather keep full precision.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        df.to_parquet(path, index=False)
+    elif ext == '.feather':
+        df.reset_index(drop=True).to_feather(path)
+    elif ext == '.csv':
+        df.to_csv(path, index=False, float_format=float_format)
+    else:
+        raise ValueError(f"Unknown results format for {path}, expected one of {list(RESULT_FORMATS.values())}")
+
+
+def write_results_chunks(frames, path, columns, float_format='%.4f'):
+    '''Write an iterable of DataFrames as one results file, one piece at a time.
+
+    Used for results too large to hold as one DataFrame: only the current
+    piece is in memory. columns gives the header when there are no pieces.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in RESULT_FORMATS.values():
+        raise ValueError(f"Unknown results format for {path}, expected one of {list(RESULT_FORMATS.values())}")
+    writer = None
+    try:
+        for df in frames:
+            df = df.reset_index(drop=True)
+            if ext == '.csv':
+                df.to_csv(path, mode='w' if writer is None else 'a', header=writer is None,
+                          index=False, float_format=float_format)
+                writer = True
+                continue
+            import pyarrow as pa
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                if ext == '.parquet':
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    writer = pa.ipc.new_file(path, table.schema)  # Feather v2 is the Arrow IPC file format
+            writer.write_table(table)
+    finally:
+        if writer not in (None, True):
+            writer.close()
+    if writer is None:
+        write_results(pd.DataFrame(columns=columns), path, float_format)
+
+
+def results_columns(path):
+    '''Column names of a results file, read from its header or schema only.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    if ext == '.feather':
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.names
+    if ext == '.csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    raise ValueError(f"Unknown results format for {path}, expected one of {list(RESULT_FORMATS.values())}")
+
+
+def read_results(path, columns=None):
+    '''Load a results file written by write_results(); columns limits what is read.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        return pd.read_parquet(path, columns=columns)
+    if ext == '.feather':
+        return pd.read_feather(path, columns=columns)
+    if ext == '.csv':
+        return pd.read_csv(path, usecols=columns)
+    raise ValueError(f"Unknown results format for {path}, expected one of {list(RESULT_FORMATS.values())}")
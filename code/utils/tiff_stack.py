@@ -0,0 +1,156 @@
+'''TIFF stacks
+
+Block-wise access to multi-page TIFF recordings for the converters.
+Contiguous, uncompressed stacks are memory-mapped, so frames are read
+straight from the file with no per-page decoding; other stacks are decoded
+page by page into a reused buffer. Either way memory stays at one block of
+frames however long the recording is.
+
+12/16-bit frames are brought to 8 bits with one scaling for the whole stack,
+so brightness does not flicker from frame to frame (flicker that MOG2 would
+take for foreground).'''
+
+import numpy as np
+import tifffile
+
+
+NORMALIZE_MODES = ('global', 'percentile', 'frame')
+
+
+class TiffStack:
+    '''Frames of one TIFF file, shape (frames,) + frame_shape.
+
+    uint8_blocks() yields the frames as uint8, block_size frames at a time.
+    uint8 data is passed through untouched (views of the memory map when
+    possible). Deeper data is scaled into one preallocated uint8 buffer
+    according to normalize:
+
+    'global'     -> 0..max of sample_pages pages spread over the stack maps to 0..255
+    'percentile' -> the given low/high percentiles of those pages map to 0..255
+    'frame'      -> every frame is scaled by its own maximum (flickers; the old behaviour)
+
+    For 8/16-bit integer data the global and percentile scalings are a
+    lookup table built once, so each frame costs one table lookup per pixel.'''
+
+    def __init__(self, path, block_size=64, normalize='global', percentiles=(0.1, 99.9), sample_pages=32):
+        if normalize not in NORMALIZE_MODES:
+            raise ValueError(f"Unknown normalize mode {normalize!r}, expected one of {NORMALIZE_MODES}")
+        self.path = path
+        self.block_size = block_size
+        self._tif = tifffile.TiffFile(path)
+        page = self._tif.pages[0]
+        self.frame_shape = page.shape
+        self.dtype = page.dtype
+        try:
+            self._data = tifffile.memmap(path).reshape((-1,) + self.frame_shape)
+        except ValueError:
+            self._data = None  # Compressed or scattered pages: decode them one by one
+        self.memmapped = self._data is not None
+        self.n_frames = len(self._data) if self.memmapped else len(self._tif.pages)
+        self._raw = None  # Reused buffers, allocated on first use
+        self._scaled = None
+        self._work = None
+
+        # Stack-wide scaling, decided once
+        self.normalize = normalize
+        self.value_range = None  # (low, high) mapped to (0, 255)
+        self.lut = None
+        if self.dtype != np.uint8 and normalize != 'frame':
+            self.value_range = self._sample_range(normalize, percentiles, sample_pages)
+            if self.dtype.kind in 'ui' and self.dtype.itemsize <= 2:
+                self.lut = self._make_lut(*self.value_range)
+
+    def __len__(self):
+        return self.n_frames
+
+    def read_block(self, start, stop):
+        '''Frames start..stop-1 in their stored dtype (a view when memory-mapped).
+
+        The returned array is reused by the next call.'''
+        if self.memmapped:
+            return self._data[start:stop]
+        if self._raw is None:
+            self._raw = np.empty((self.block_size,) + self.frame_shape, self.dtype)
+        block = self._raw[:stop - start]
+        for i in range(start, stop):
+            self._tif.pages[i].asarray(out=block[i - start])
+        return block
+
+    def _sample_range(self, normalize, percentiles, sample_pages):
+        '''(low, high) of the stack estimated from evenly spaced pages.'''
+        picks = np.unique(np.linspace(0, self.n_frames - 1, min(sample_pages, self.n_frames)).astype(int))
+        sample = np.stack([self.read_block(i, i + 1)[0].copy() for i in picks])
+        if normalize == 'global':
+            low, high = 0, sample.max()
+        else:
+            low, high = np.percentile(sample, percentiles)
+        return float(low), float(max(high, low + 1e-12))
+
+    def _make_lut(self, low, high):
+        '''uint8 value for every possible code of an 8/16-bit integer dtype, indexed by its unsigned bits.'''
+        codes = np.arange(2 ** (8 * self.dtype.itemsize), dtype=f'u{self.dtype.itemsize}').view(self.dtype)
+        return np.clip((codes - low) * (255 / (high - low)), 0, 255).astype(np.uint8)
+
+    def _to_uint8(self, block):
+        '''Scale a block of frames to 0-255 uint8 in preallocated buffers.'''
+        n = len(block)
+        if self._scaled is None:
+            self._scaled = np.empty((self.block_size,) + self.frame_shape, np.uint8)
+            if self.lut is None:
+                # Per-frame scaling of unsigned integers: exact integer arithmetic, wide enough for value * 255
+                if self.dtype.kind == 'u' and self.value_range is None:
+                    work_dtype = np.uint32 if self.dtype.itemsize <= 2 else np.uint64
+                else:
+                    work_dtype = np.float64
+                self._work = np.empty((self.block_size,) + self.frame_shape, work_dtype)
+        scaled = self._scaled[:n]
+
+        if self.lut is not None:
+            np.take(self.lut, block.view(f'u{self.dtype.itemsize}'), out=scaled)
+            return scaled
+
+        work = self._work[:n]
+
+        if self.value_range is not None:
+            # Wide integers and floats: one linear map for the whole stack
+            low, high = self.value_range
+            np.subtract(block, low, out=work, casting='unsafe')
+            np.multiply(work, 255 / (high - low), out=work, casting='unsafe')
+            np.clip(work, 0, 255, out=work)
+            np.copyto(scaled, work, casting='unsafe')
+            return scaled
+
+        # 'frame': every frame by its own maximum
+        peak = block.reshape(n, -1).max(axis=1)
+        peak = np.maximum(peak, 1 if self.dtype.kind == 'u' else np.finfo(np.float64).tiny)
+        peak = peak.reshape((n,) + (1,) * len(self.frame_shape))
+        if self.dtype.kind == 'u':
+            np.multiply(block, 255, out=work, dtype=work.dtype)
+            np.floor_divide(work, peak, out=work)
+        else:
+            np.divide(block, peak, out=work)
+            work *= 255
+        np.copyto(scaled, work, casting='unsafe')
+        return scaled
+
+    def uint8_block(self, start):
+        '''The block of uint8 frames starting at frame start (valid until the next call).'''
+        block = self.read_block(start, min(start + self.block_size, self.n_frames))
+        return block if self.dtype == np.uint8 else self._to_uint8(block)
+
+    def uint8_blocks(self):
+        '''Yield (start, frames) for consecutive blocks of uint8 frames.
+
+        Each yielded array is only valid until the next one is requested.'''
+        for start in range(0, self.n_frames, self.block_size):
+            yield start, self.uint8_block(start)
+
+    def close(self):
+        self._data = None
+        self._tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
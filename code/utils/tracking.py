@@ -0,0 +1,74 @@
+'''Drop tracking
+
+Associates drop centroids from frame to frame so every drop keeps one ID
+and line crossings are decided per drop.'''
+
+from collections import defaultdict
+
+
+class CentroidTracker:
+    '''Nearest-neighbour tracker for drop centroids.
+
+    Live tracks are binned on a grid with cells of max_distance pixels, so a
+    detection is only compared with tracks in the 3 x 3 neighbouring cells and
+    the cost per frame stays linear in the number of drops. Candidate pairs are
+    matched closest first, each track and detection at most once. Unmatched
+    detections start new tracks; a track unseen for more than max_missed frames
+    is retired.'''
+
+    def __init__(self, line_position, max_distance=40, max_missed=2, first_id=1):
+        self.line_position = line_position
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.next_id = first_id
+        self.tracks = {}  # track id -> (cx, cy, frames missed)
+
+    def update(self, centroids):
+        '''Match one frame's (cx, cy) centroids to the tracks.
+
+        Returns (track_ids, crossed), both parallel to centroids. crossed is True
+        when that drop's own previous position was above the counting line and
+        the current one is on or below it.'''
+        cell = self.max_distance
+        grid = defaultdict(list)
+        for track_id, (cx, cy, _) in self.tracks.items():
+            grid[(cx // cell, cy // cell)].append(track_id)
+
+        pairs = []
+        for i, (cx, cy) in enumerate(centroids):
+            gx, gy = cx // cell, cy // cell
+            for nx in (gx - 1, gx, gx + 1):
+                for ny in (gy - 1, gy, gy + 1):
+                    for track_id in grid.get((nx, ny), ()):
+                        tx, ty, _ = self.tracks[track_id]
+                        dist2 = (cx - tx) ** 2 + (cy - ty) ** 2
+                        if dist2 <= cell * cell:
+                            pairs.append((dist2, i, track_id))
+        pairs.sort()
+
+        track_ids = [None] * len(centroids)
+        crossed = [False] * len(centroids)
+        matched = set()
+        for _, i, track_id in pairs:
+            if track_ids[i] is not None or track_id in matched:
+                continue
+            track_ids[i] = track_id
+            matched.add(track_id)
+            prev_cy = self.tracks[track_id][1]
+            crossed[i] = prev_cy < self.line_position <= centroids[i][1]
+
+        for i in range(len(centroids)):
+            if track_ids[i] is None:
+                track_ids[i] = self.next_id
+                self.next_id += 1
+
+        tracks = {
+            track_id: (cx, cy, missed + 1)
+            for track_id, (cx, cy, missed) in self.tracks.items()
+            if track_id not in matched and missed < self.max_missed
+        }
+        for track_id, (cx, cy) in zip(track_ids, centroids):
+            tracks[track_id] = (cx, cy, 0)
+        self.tracks = tracks
+
+        return track_ids, crossed
@@ -0,0 +1,41 @@
+'''Video codecs
+
+Writers for the converters' AVI output. MJPG is small and fast but lossy;
+the lossless codecs keep every pixel of the source, at a higher size or
+encode cost, which codec_benchmark.py measures on a sample clip.'''
+
+import cv2
+
+
+# Codec name -> AVI fourcc
+CODECS = {
+    'mjpg': 'MJPG',     # Lossy JPEG per frame; quality 0-100 when given
+    'ffv1': 'FFV1',     # Lossless, compressed (smallest lossless)
+    'png': 'MPNG',      # Lossless, one PNG per frame
+    'huffyuv': 'HFYU',  # Lossless, fast, larger files
+    'raw': 'RGBA',      # Uncompressed 32-bit pixels (largest, no encode cost)
+}
+LOSSLESS = ('ffv1', 'png', 'huffyuv', 'raw')
+
+
+def open_writer(path, fps, frame_size, codec='mjpg', quality=None):
+    '''cv2.VideoWriter writing BGR frames of frame_size (width, height) with codec.
+
+    fps should be the source frame rate, so times computed from frame
+    numbers stay right. quality (mjpg only) uses OpenCV's own MJPEG encoder,
+    whose JPEG quality can be set; quality=None keeps the default MJPG writer.'''
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {tuple(CODECS)}")
+    fourcc = cv2.VideoWriter_fourcc(*CODECS[codec])
+
+    if codec != 'mjpg':
+        out = cv2.VideoWriter(path, cv2.CAP_FFMPEG, fourcc, fps, frame_size)
+    elif quality is None:
+        out = cv2.VideoWriter(path, fourcc, fps, frame_size)
+    else:
+        out = cv2.VideoWriter(path, cv2.CAP_OPENCV_MJPEG, fourcc, fps, frame_size)
+        out.set(cv2.VIDEOWRITER_PROP_QUALITY, quality)
+
+    if not out.isOpened():
+        raise IOError(f"Failed to open a {codec} writer for {path}")
+    return out
@@ -1,7 +1,7 @@
 import cv2
 import os
-import tifffile as tiff
-import numpy as np
+from tiff_stack import TiffStack  # Memory-mapped, block-wise TIFF frames (utils/)
+from video_codecs import open_writer  # Selectable output codecs (utils/)
 
 # Define the input file path
 input_path = r'Video file path'
@@ -15,29 +15,38 @@ output_dir = r'C:/Users/Admin/Desktop/New 2'
 os.makedirs(output_dir, exist_ok=True)  # Ensure the output directory exists
 output_path = os.path.join(output_dir, f"{output_file_name}.avi")
 
+# 12/16-bit TIFF to 8-bit: 'global' (stack maximum), 'percentile' (0.1-99.9 % of the stack)
+# or 'frame' (each frame by its own maximum, which makes the brightness flicker)
+normalize = 'global'
+
+# Output codec: 'mjpg' (lossy, small), or lossless 'ffv1', 'png', 'huffyuv', 'raw' (see codec_benchmark.py)
+codec = 'mjpg'
+quality = None  # MJPG JPEG quality 0-100; None keeps the default MJPG writer
+
+# TIFFs carry no frame rate: the recording's FPS (videos keep their own)
+tiff_fps = 500
+
 # Check the input file type
 file_extension = os.path.splitext(input_path)[1].lower()
 
 if file_extension in ['.tif', '.tiff']:
     # Handle TIFF to AVI conversion
-    with tiff.TiffFile(input_path) as tiff_file:
+    with TiffStack(input_path, normalize=normalize) as stack:
         # Get frame dimensions
-        first_frame = tiff_file.pages[0].asarray()
-        height, width = first_frame.shape if len(first_frame.shape) == 2 else first_frame.shape[:2]
-        fps = 60  # Define FPS manually
-
-        # Define codec and create VideoWriter
-        fourcc = cv2.VideoWriter_fourcc(*'MJPG')  # Codec for AVI format
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-
-        # Process each frame
-        for page in tiff_file.pages:
-            frame = page.asarray()  # Load frame
-            if frame.dtype != np.uint8:
-                frame = (frame / frame.max() * 255).astype(np.uint8)  # Normalize to 0–255
-            if len(frame.shape) == 2:  # Grayscale to RGB
-                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-            out.write(frame)
+        height, width = stack.frame_shape[:2]
+        fps = tiff_fps
+
+        # Create VideoWriter with the chosen codec
+        out = open_writer(output_path, fps, (width, height), codec, quality)
+
+        # Process the frames block by block, normalised to 0–255 uint8
+        bgr = None
+        for _, frames in stack.uint8_blocks():
+            for frame in frames:
+                if frame.ndim == 2:  # Grayscale to RGB, into one reused buffer
+                    bgr = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR, dst=bgr)
+                    frame = bgr
+                out.write(frame)
 
         # Release resources
         out.release()
@@ -53,12 +62,10 @@ elif file_extension in ['.mp4', '.avi', '.mkv', '.cine', '.mov', '.wmv', '.flv',
         # Get frame dimensions and frame rate
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = 60
-        # fps = int(cap.get(cv2.CAP_PROP_FPS)) or 30  # Use FPS from input or default to 30
+        fps = cap.get(cv2.CAP_PROP_FPS) or tiff_fps  # Keep the source FPS (fractional rates too)
 
-        # Define codec and create VideoWriter
-        fourcc = cv2.VideoWriter_fourcc(*'MJPG')  # Codec for AVI format (MJPG)
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        # Create VideoWriter with the chosen codec
+        out = open_writer(output_path, fps, (width, height), codec, quality)
 
         # Read and write each frame
         while cap.isOpened():
@@ -1,7 +1,11 @@
 import cv2
 import os
-import tifffile as tiff
-import numpy as np
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from tiff_stack import TiffStack  # Memory-mapped, block-wise TIFF frames (utils/)
+from processed_manifest import ProcessedManifest  # Skips files already converted
+from video_codecs import open_writer  # Selectable output codecs (utils/)
 
 # Define the input directory containing files (Modify this path as needed)
 input_dir = r'Video file folder path'
@@ -10,103 +14,167 @@ input_dir = r'Video file folder path'
 base_input_folder_name = os.path.basename(os.path.normpath(input_dir))  # Get input folder name
 output_base_dir = os.path.join(r'C:/Users/Admin/Desktop/New 2/Water on soap/20250422', base_input_folder_name)
 
-# Ensure the base output directory exists
-os.makedirs(output_base_dir, exist_ok=True)
-
 # Supported file extensions
 video_extensions = ['.mp4', '.avi', '.mkv', '.cine', '.mov', '.wmv', '.flv', '.m4v']
 tiff_extensions = ['.tif', '.tiff']
 
-# Ask once whether to rotate all videos
-rotate_all = input("Rotate all videos 90° clockwise? (y/n): ").strip().lower() == 'y'
-
-# Walk through the input directory, including subfolders
-for root, _, files in os.walk(input_dir):
-    for file_name in files:
-        input_path = os.path.join(root, file_name)
-
-        # Get the file extension
-        file_extension = os.path.splitext(file_name)[1].lower()
+# 12/16-bit TIFF to 8-bit: 'global' (stack maximum), 'percentile' (0.1-99.9 % of the stack)
+# or 'frame' (each frame by its own maximum, which makes the brightness flicker)
+normalize = 'global'
 
-        # Create a mirrored folder structure in the output directory
-        relative_path = os.path.relpath(root, input_dir)  # Get relative path from base folder
-        output_dir = os.path.join(output_base_dir, relative_path)
-        os.makedirs(output_dir, exist_ok=True)  # Create subfolder if needed
+# Output codec: 'mjpg' (lossy, small), or lossless 'ffv1', 'png', 'huffyuv', 'raw' (see codec_benchmark.py)
+codec = 'mjpg'
+quality = None  # MJPG JPEG quality 0-100; None keeps the default MJPG writer
 
-        # Generate output file name and path
-        input_base_name = os.path.splitext(file_name)[0]
-        output_file_name = f"{input_base_name}_converted.avi"
-        output_path = os.path.join(output_dir, output_file_name)
-
-        if file_extension in tiff_extensions:
-            # Handle TIFF to AVI conversion
-            try:
-                with tiff.TiffFile(input_path) as tiff_file:
-                    first_frame = tiff_file.pages[0].asarray()
-                    height, width = first_frame.shape if len(first_frame.shape) == 2 else first_frame.shape[:2]
-                    fps = 60  # Define FPS manually
+# TIFFs carry no frame rate: the recording's FPS (videos keep their own)
+tiff_fps = 500
 
-                    # Swap width & height if rotating
-                    output_size = (height, width) if rotate_all else (width, height)
+# Rotation applied to every file: None, cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE or cv2.ROTATE_180
+rotate = None
 
-                    # Define codec and create VideoWriter
-                    fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-                    out = cv2.VideoWriter(output_path, fourcc, fps, output_size)
+# Files converted at the same time, one process each
+workers = os.cpu_count()
 
-                    for page in tiff_file.pages:
-                        frame = page.asarray()
-                        if frame.dtype != np.uint8:
-                            frame = (frame / frame.max() * 255).astype(np.uint8)  # Normalize to 0–255
-                        if len(frame.shape) == 2:
-                            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+# Files already converted with the same settings (and unchanged since) are skipped
+skip_processed = True
 
-                        if rotate_all:
-                            frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+report_columns = ['File', 'Status', 'Frames', 'FPS', 'Duration (s)', 'Wall Time (s)', 'Throughput (frames/s)', 'Error']
 
-                        out.write(frame)
 
-                    out.release()
-                    print(f"✅ TIFF Converted {'and rotated ' if rotate_all else ''}: {output_file_name}")
+# Frame source for one input: (frames iterator, width, height, fps)
+def open_frames(input_path):
+    if os.path.splitext(input_path)[1].lower() in tiff_extensions:
+        stack = TiffStack(input_path, normalize=normalize)
+        height, width = stack.frame_shape[:2]
 
-            except Exception as e:
-                print(f"❌ Error processing TIFF {file_name}: {e}")
-
-        elif file_extension in video_extensions:
-            # Handle video file conversion
+        def frames():
+            # Frames arrive block by block, already normalised to 0–255 uint8
+            bgr = None
             try:
-                cap = cv2.VideoCapture(input_path)
-
-                if not cap.isOpened():
-                    print(f"🚨 Failed to open video file: {file_name}")
-                    continue
-
-                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = cap.get(cv2.CAP_PROP_FPS) or 60  # Use detected FPS or default to 60
-
-                output_size = (height, width) if rotate_all else (width, height)
-
-                fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-                out = cv2.VideoWriter(output_path, fourcc, fps, output_size)
-
-                while cap.isOpened():
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-
-                    if rotate_all:
-                        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-
-                    out.write(frame)
-
-                cap.release()
-                out.release()
-                print(f"✅ Video Converted {'and rotated ' if rotate_all else ''}: {output_file_name}")
-
-            except Exception as e:
-                print(f"❌ Error processing video {file_name}: {e}")
-
+                for _, block in stack.uint8_blocks():
+                    for frame in block:
+                        if frame.ndim == 2:
+                            bgr = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR, dst=bgr)
+                            frame = bgr
+                        yield frame
+            finally:
+                stack.close()
+
+        return frames(), width, height, tiff_fps
+
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise IOError(f"Failed to open video file: {input_path}")
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or tiff_fps  # Keep the source FPS
+
+    def frames():
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    return
+                yield frame
+        finally:
+            cap.release()
+
+    return frames(), width, height, fps
+
+
+# Convert one file and report how it went instead of raising
+def convert_file(input_path, output_path):
+    cv2.setNumThreads(1)  # One OpenCV thread per process so workers don't oversubscribe cores
+    start = time.perf_counter()
+    row = {'File': input_path, 'Status': 'ok', 'Frames': 0, 'FPS': 0.0, 'Error': ''}
+    try:
+        frames, width, height, fps = open_frames(input_path)
+        row['FPS'] = fps
+
+        # Swap width & height if rotating by 90°
+        output_size = (height, width) if rotate in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE) else (width, height)
+
+        # Create VideoWriter with the chosen codec
+        out = open_writer(output_path, fps, output_size, codec, quality)
+        try:
+            for frame in frames:
+                if rotate is not None:
+                    frame = cv2.rotate(frame, rotate)
+                out.write(frame)
+                row['Frames'] += 1
+        finally:
+            out.release()
+    except Exception as e:
+        row['Status'] = 'failed'
+        row['Error'] = f"{type(e).__name__}: {e}"
+
+    row['Wall Time (s)'] = time.perf_counter() - start
+    row['Duration (s)'] = row['Frames'] / row['FPS'] if row['FPS'] else 0.0
+    row['Throughput (frames/s)'] = row['Frames'] / row['Wall Time (s)']
+    return row
+
+
+if __name__ == "__main__":
+    # Ensure the base output directory exists
+    os.makedirs(output_base_dir, exist_ok=True)
+
+    processed = ProcessedManifest(os.path.join(output_base_dir, 'processed.json'),
+                                  {'rotate': rotate, 'codec': codec, 'quality': quality, 'tiff_fps': tiff_fps,
+                                   'normalize': normalize})
+
+    # Walk through the input directory, including subfolders
+    jobs = []
+    skipped = []
+    for root, _, files in os.walk(input_dir):
+        for file_name in files:
+            input_path = os.path.join(root, file_name)
+
+            # Get the file extension
+            file_extension = os.path.splitext(file_name)[1].lower()
+            if file_extension not in tiff_extensions + video_extensions:
+                print(f"⚠️ Skipping unsupported file: {file_name}")
+                continue
+
+            if skip_processed and processed.is_current(input_path):
+                skipped.append({'File': input_path, 'Status': 'skipped', **processed.info(input_path)})
+                continue
+
+            # Create a mirrored folder structure in the output directory
+            relative_path = os.path.relpath(root, input_dir)  # Get relative path from base folder
+            output_dir = os.path.join(output_base_dir, relative_path)
+            os.makedirs(output_dir, exist_ok=True)  # Create subfolder if needed
+
+            # Generate output file name and path
+            input_base_name = os.path.splitext(file_name)[0]
+            output_path = os.path.join(output_dir, f"{input_base_name}_converted.avi")
+            jobs.append((input_path, output_path))
+
+    print(f"Converting {len(jobs)} files with {workers} workers ({len(skipped)} already converted)...")
+
+    # Record each converted file straight away, so an interrupted batch keeps its progress
+    def finished(row, job):
+        if row['Status'] == 'ok':
+            processed.mark_done(job[0], [job[1]], Frames=row['Frames'], FPS=row['FPS'])
         else:
-            print(f"⚠️ Skipping unsupported file: {file_name}")
-
-print(f"\n Batch processing completed! Converted files saved in: {output_base_dir}")
+            print(f"❌ Error converting {job[0]}: {row['Error']}")
+        return row
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(convert_file, *job): i for i, job in enumerate(jobs)}
+            rows = {}
+            for future in as_completed(futures):  # In the order the files finish
+                i = futures[future]
+                rows[i] = finished(future.result(), jobs[i])
+            report = [rows[i] for i in range(len(jobs))]  # Back in job order
+    else:
+        report = [finished(convert_file(*job), job) for job in jobs]
+
+    # Per-file report
+    report_df = pd.DataFrame(skipped + report, columns=report_columns)
+    report_path = os.path.join(output_base_dir, 'conversion_report.csv')
+    report_df.to_csv(report_path, index=False, float_format='%.2f')
+    print(report_df.drop(columns='Error').to_string(index=False, float_format='%.2f'))
+
+    print(f"\n Batch processing completed! Converted files saved in: {output_base_dir}")
+    print(f"Report saved at {report_path}")
@@ -0,0 +1,100 @@
+import cv2
+import os
+import time
+import numpy as np
+import pandas as pd
+from skimage.metrics import structural_similarity as ssim
+from frame_sources import open_video  # Videos, TIFF stacks and image folders (utils/)
+from video_codecs import LOSSLESS, open_writer  # Converter codecs (utils/)
+
+# Sample clip (video, TIFF stack or image folder) and where the test encodes go
+sample_path = r'Sample video file path'
+output_dir = r'C:/Users/Admin/Desktop/codec_benchmark'
+
+# Frames taken from the start of the sample (kept in memory, so only encoding is timed)
+n_frames = 500
+
+# FPS for TIFF stacks and image folders, which carry no frame rate
+source_fps = 500
+
+# (codec, MJPG quality) pairs to compare; quality None is the converters' default MJPG writer
+candidates = [
+    ('mjpg', None),
+    ('mjpg', 95),
+    ('mjpg', 75),
+    ('ffv1', None),
+    ('png', None),
+    ('huffyuv', None),
+    ('raw', None),
+]
+
+os.makedirs(output_dir, exist_ok=True)
+
+# Load the sample frames
+cap = open_video(sample_path, prefetch=0)
+fps = cap.get(cv2.CAP_PROP_FPS) or source_fps
+frames = []
+while len(frames) < n_frames:
+    ret, frame = cap.read()
+    if not ret:
+        break
+    if frame.ndim == 2:
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    frames.append(frame.copy())
+cap.release()
+height, width = frames[0].shape[:2]
+source_gray = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+print(f"Benchmarking {len(frames)} frames of {width}x{height} at {fps:g} fps")
+
+rows = []
+for codec, quality in candidates:
+    name = codec if quality is None else f"{codec}_q{quality}"
+    output_path = os.path.join(output_dir, f"sample_{name}.avi")
+
+    # Encode speed
+    start = time.perf_counter()
+    out = open_writer(output_path, fps, (width, height), codec, quality)
+    for frame in frames:
+        out.write(frame)
+    out.release()
+    encode_time = time.perf_counter() - start
+
+    # Decode speed and fidelity against the source frames
+    cap = cv2.VideoCapture(output_path)
+    decoded = []
+    start = time.perf_counter()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        decoded.append(frame)
+    decode_time = time.perf_counter() - start
+    written_fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    scores = []
+    max_diff = 0
+    for original, gray, frame in zip(frames, source_gray, decoded):
+        scores.append(ssim(gray, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), win_size=3))
+        max_diff = max(max_diff, int(cv2.norm(original, frame, cv2.NORM_INF)))
+
+    rows.append({
+        'Codec': name,
+        'Lossless': codec in LOSSLESS,
+        'Encode (frames/s)': len(frames) / encode_time,
+        'Decode (frames/s)': len(decoded) / decode_time if decoded else 0.0,
+        'Size (MB)': os.path.getsize(output_path) / 1e6,
+        'MB per 1000 frames': os.path.getsize(output_path) / 1e3 / len(frames),
+        'Mean SSIM': np.mean(scores) if scores else np.nan,
+        'Min SSIM': np.min(scores) if scores else np.nan,
+        'Max Pixel Error': max_diff,
+        'Frames Read': len(decoded),
+        'FPS Kept': written_fps == fps,
+    })
+    print(f"{name}: done")
+
+report_df = pd.DataFrame(rows)
+report_path = os.path.join(output_dir, 'codec_benchmark.csv')
+report_df.to_csv(report_path, index=False)
+print(report_df.to_string(index=False, float_format='%.4f'))
+print(f"Benchmark saved at {report_path}")
@@ -2,131 +2,198 @@ import cv2
 import numpy as np
 import pandas as pd
 import os
-from Functions import crop  # Importing your custom function
+from droplet_engine import DetectionConfig, detect_drops, preview_due, run_chunked
+from frame_sources import open_video  # Prefetching reader
+from crop_writer import CropWriter  # Background drop image writer
+from results_io import RESULT_FORMATS, write_results
+from record_buffer import RecordBuffer  # Typed per-drop storage
+from checkpoint import RunCheckpoint  # Periodic saves so an interrupted run can resume
 
 # Set parameters
 video_path = r'input video path'  
 output_folder = r'output folder name'
-os.makedirs(output_folder, exist_ok=True)
-
-Scale = 96  # mm
-fps = 500
+results_path = r'C:/Users/Admin/Desktop/1pt06_4mlpmin/1stdrop_ellipses'  # Extension added from output_format
 
 # Define frame range
 start_frame = 1
 end_frame = 4852
 
-# Open video
-rec = cv2.VideoCapture(video_path)
-rec.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-
-# Scaling ratio
-frame_width = int(rec.get(4))
-if frame_width == 0:
-    print("Error: Could not read video properties.")
-    exit()
-ratio = Scale / frame_width  # mm/pixel
-
-# Background subtractor
-obj_det = cv2.createBackgroundSubtractorMOG2(varThreshold=16)
-
-# Drop detection settings
-line_position = 60  
-min_contour_area = 1100
-max_contour_area = 3000
-
-drop_data = []
-frame_no = start_frame
-drop_count = 0
-previous_centroids = []
-
-while frame_no <= end_frame:
-    ret, frame = rec.read()
-    if not ret:
-        break
+# Display: 0 = headless (no GUI work at all), N = show every Nth frame
+preview_every = 0
 
-    # frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)  
+# Parallel mode: > 1 splits the frame range into chunks processed in separate
+# processes (headless). Each chunk first warms up its background model on the
+# warmup_frames frames before it. About 4x the MOG2 history (2000) matches a
+# sequential run's drops and drop numbers; less (e.g. 500) is faster but only
+# approximates them near chunk starts.
+workers = 1
+warmup_frames = 2000
 
-    # Use the familiar cropping function from v3pt0.py
-    roi = crop(frame, 0.44, 0.32, 0.15, 0.65)
+# Drop images: 'png' = one PNG per drop, 'npz' = packed into a few archives
+crop_mode = 'png'
 
-    mask = obj_det.apply(roi)
-    _, mask = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY)
+# Results file: 'csv', or 'parquet'/'feather' for typed full-precision columns
+output_format = 'csv'
 
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-
-    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-    current_centroids = []
-
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-
-        if min_contour_area < area < max_contour_area:
-            M = cv2.moments(cnt)
-            if M['m00'] != 0:
-                cx = int(M['m10'] / M['m00'])  
-                cy = int(M['m01'] / M['m00'])  
-                current_centroids.append((cx, cy))
-
-                # Check for drop crossing line
-                for (prev_cx, prev_cy) in previous_centroids:
-                    if prev_cy < line_position <= cy:
-                        drop_count += 1
-                        break
+# Sequential runs save their results and frame position every checkpoint_every
+# frames (0 = never). Rerunning after a crash or 'q' resumes from there, with
+# the background model re-warmed on warmup_frames frames.
+checkpoint_every = 1000
 
+# Drop detection settings
+config = DetectionConfig(
+    roi=(0.44, 0.32, 0.15, 0.65),
+    min_contour_area=1100,
+    max_contour_area=3000,
+    line_position=60,
+    scale=96,  # mm
+    fps=500,
+    fit_ellipse=True,
+)
+
+# Output columns for the record fields
+ellipse_columns = {
+    'track_id': 'Drop number', 'frame': 'Frame', 'time': 'Time(s)', 'x': 'X (mm)', 'y': 'Y (mm)',
+    'major_axis': 'Major Axis (mm)', 'minor_axis': 'Minor Axis (mm)', 'angle': 'Angle (deg)',
+}
+
+# Fit, crop and record every drop of a stream of detections
+# With a checkpoint, records, counts and the crop index continue from it and are saved periodically
+def collect_ellipses(detections, preview_every=0, checkpoint=None):
+    records = checkpoint.records if checkpoint else RecordBuffer()
+    drop_count = checkpoint.counters.get('drop_count', 0) if checkpoint else 0
+    crop_index = load_crop_index(checkpoint)
+    writer = CropWriter(output_folder, crop_mode)
+
+    try:
+        for det in detections:
+            roi = det.roi
+            drop_count += det.crossings
+            show = preview_due(det, preview_every)
+            saved = 0  # Drops saved from this frame
+
+            for drop in det.drops:
                 # **Fit Ellipse (Only if Contour has Enough Points)**
-                if len(cnt) >= 5:
-                    ellipse = cv2.fitEllipse(cnt)
-                    (xc, yc), (major_axis, minor_axis), angle = ellipse
-
-                    # Convert to mm
-                    xc_mm, yc_mm = xc * ratio, yc * ratio
-                    major_axis_mm = major_axis * ratio
-                    minor_axis_mm = minor_axis * ratio
-
-                    # **Draw Ellipse**
-                    cv2.ellipse(roi, ellipse, (255, 0, 0), 2)
-
-                    # **Get Bounding Box to Crop the Drop**
-                    x, y, w, h = cv2.boundingRect(cnt)
-
-                    # **Ensure bounding box is within image limits**
-                    x, y = max(0, x), max(0, y)
-                    w, h = min(roi.shape[1] - x, w), min(roi.shape[0] - y, h)
-
-                    # **Save Drop Image**
-                    drop_crop = roi[y:y+h, x:x+w].copy()
-                    drop_filename = os.path.join(output_folder, f'drop_frame{frame_no}.png')
-                    cv2.imwrite(drop_filename, drop_crop)
-
-                    # **Save Drop Data**
-                    drop_data.append([
-                        frame_no, frame_no / fps, xc_mm, yc_mm, major_axis_mm, minor_axis_mm, angle
-                    ])
-
-    previous_centroids = current_centroids
-
-    # Display
-    cv2.imshow('Video', cv2.resize(frame, (0, 0), fx=0.5, fy=0.5))
-    cv2.imshow('Mask', mask)
-    cv2.imshow('ROI', roi)
-
-    frame_no += 1  
-
-    key = cv2.waitKey(1) & 0xFF
-    if key == ord('q'):
-        break
-
-rec.release()
-cv2.destroyAllWindows()
-
-# Save Data
-df_ellipses = pd.DataFrame(drop_data, columns=[
-    'Frame', 'Time(s)', 'X (mm)', 'Y (mm)', 'Major Axis (mm)', 'Minor Axis (mm)', 'Angle (deg)'
-])
-df_ellipses.to_csv(r'C:/Users/Admin/Desktop/1pt06_4mlpmin/1stdrop_ellipses.csv', index=False, float_format='%.4f')
-
-print(f"Processing completed! {len(drop_data)} drops detected. Data saved in 'drop_ellipses.csv'.")
\ No newline at end of file
+                if drop.ellipse is None:
+                    continue
+
+                # **Get Bounding Box to Crop the Drop**
+                x, y, w, h = cv2.boundingRect(drop.contour)
+
+                # **Ensure bounding box is within image limits**
+                x, y = max(0, x), max(0, y)
+                w, h = min(roi.shape[1] - x, w), min(roi.shape[0] - y, h)
+
+                # **Save Drop Image** (before any preview drawing touches the ROI)
+                # Frame number plus the drop's index in the frame keeps names unique
+                writer.save(f'frame{det.frame_no:06d}_{saved}', roi[y:y+h, x:x+w])
+                saved += 1
+
+                # **Save Drop Data** (converted to mm)
+                records.add_drop(det, drop)
+
+            if checkpoint and checkpoint.due(det.frame_no):
+                writer = save_checkpoint(checkpoint, det.frame_no, drop_count, writer, crop_index)
+
+            if not show:
+                continue
+
+            # **Draw Ellipses**
+            for drop in det.drops:
+                if drop.ellipse is not None:
+                    cv2.ellipse(roi, drop.ellipse, (255, 0, 0), 2)
+
+            # Display
+            cv2.imshow('Video', cv2.resize(det.frame, (0, 0), fx=0.5, fy=0.5))
+            cv2.imshow('Mask', det.mask)
+            cv2.imshow('ROI', roi)
+
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                if checkpoint:
+                    writer = save_checkpoint(checkpoint, det.frame_no, drop_count, writer, crop_index, stop=True)
+                break
+    finally:
+        crop_index += writer.close()
+
+    if preview_every:
+        cv2.destroyAllWindows()
+
+    return records, drop_count, crop_index
+
+
+# collect_ellipses() for run_chunked(): the records come back to the main process as one array
+def collect_ellipse_array(detections):
+    records, drop_count, crop_index = collect_ellipses(detections)
+    data = records.to_array()
+    records.clear()
+    return data, drop_count, crop_index
+
+
+# Crop index rows saved with a checkpoint (only the first crop_rows are covered by it)
+def load_crop_index(checkpoint):
+    if not checkpoint or not checkpoint.resumed:
+        return []
+    index = pd.read_csv(os.path.join(checkpoint.parts_dir, 'drop_crops_index.csv'), keep_default_na=False, dtype=str)
+    return list(index.itertuples(index=False, name=None))[:checkpoint.counters['crop_rows']]
+
+
+# Checkpoint after frame_no; every crop so far is written and indexed first
+# Returns a fresh crop writer to carry on with
+def save_checkpoint(checkpoint, frame_no, drop_count, writer, crop_index, stop=False):
+    crop_index += writer.close()
+    os.makedirs(checkpoint.parts_dir, exist_ok=True)
+    pd.DataFrame(crop_index, columns=['Name', 'File', 'Key']).to_csv(
+        os.path.join(checkpoint.parts_dir, 'drop_crops_index.csv'), index=False)
+    save = checkpoint.stop if stop else checkpoint.save
+    save(frame_no, drop_count=drop_count, crop_rows=len(crop_index))
+    return CropWriter(output_folder, crop_mode)
+
+
+if __name__ == "__main__":
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Open video
+    rec = open_video(video_path)
+    if int(rec.get(4)) == 0:
+        rec.release()
+        print("Error: Could not read video properties.")
+        exit()
+
+    if workers > 1:
+        rec.release()
+        chunks = run_chunked(video_path, config, collect_ellipse_array, start_frame, end_frame, workers, warmup_frames)
+        # Chunks number their drops independently; map them onto one numbering
+        for (data, _, _), id_map in chunks:
+            data['track_id'] = [id_map[track_id] for track_id in data['track_id']]
+        drop_data = np.concatenate([data for (data, _, _), _ in chunks])
+        drop_total = len(drop_data)
+        drop_count = sum(count for (_, count, _), _ in chunks)
+        crop_index = [entry for (_, _, index), _ in chunks for entry in index]
+    else:
+        try:
+            checkpoint = RunCheckpoint(results_path + RESULT_FORMATS[output_format], config, checkpoint_every)
+            detections = detect_drops(rec, config, checkpoint.start_frame(start_frame), end_frame,
+                                      warmup_frames if checkpoint.resumed else 0, checkpoint.tracker)
+            records, drop_count, crop_index = collect_ellipses(detections, preview_every, checkpoint)
+        finally:
+            rec.release()
+        drop_total = len(records)
+
+    # Save Data
+    if workers > 1:
+        df_ellipses = pd.DataFrame({title: drop_data[field] for field, title in ellipse_columns.items()})
+        write_results(df_ellipses, results_path + RESULT_FORMATS[output_format])
+    else:
+        records.write_results(results_path + RESULT_FORMATS[output_format], ellipse_columns)  # Block by block
+
+    # Where each drop image went
+    pd.DataFrame(crop_index, columns=['Name', 'File', 'Key']).to_csv(os.path.join(output_folder, 'drop_crops_index.csv'), index=False)
+
+    if workers <= 1:
+        if checkpoint.stopped:
+            print(f"Stopped at frame {checkpoint.frame_no}; run again to resume.")
+        else:
+            checkpoint.finish()
+
+    print(f"Processing completed! {drop_total} drops detected. Data saved in 'drop_ellipses.csv'.")
@@ -1,13 +1,14 @@
-import pandas as pd
-import matplotlib.pyplot as plt
 import matplotlib.patches as patches
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # Off-screen canvas, no GUI needed
 import numpy as np
 import os
 import cv2
+from batch_pool import run_batch  # utils/: serial or process-pool per-drop work
+from results_io import read_results  # utils/: CSV, Parquet or Feather results
 
-# Load CSV
+# Load results (ellipse_fit_single output: CSV, Parquet or Feather)
 file_path = r"CSV file path"
-df = pd.read_csv(file_path)
 
 # Define columns
 drop_col = "Drop number"
@@ -20,109 +21,137 @@ angle_col = "Angle (deg)"
 
 # Select drops
 drop_range = (1, 26)
-filtered_df = df[df[drop_col].between(drop_range[0], drop_range[1])]
-
-# Compute Reduced Time
-filtered_df["Reduced Time (s)"] = filtered_df.groupby(drop_col)[time_col].transform(lambda x: x - x.iloc[0])
 
 # Output folders
 output_root = r"C:/Users/Admin/Desktop/1pt04_10mlpmin/drop_videos"
 frames_dir = os.path.join(output_root, "frames")
 videos_dir = os.path.join(output_root, "videos")
 
-os.makedirs(frames_dir, exist_ok=True)
-os.makedirs(videos_dir, exist_ok=True)
-
 # Video settings
 frame_width = 600
 frame_height = 600
 fps = 10  # frames per second
-
-# Loop over each drop
-for drop_no, group in filtered_df.groupby(drop_col):
-    drop_frames_path = os.path.join(frames_dir, f"drop_{drop_no}")
-    os.makedirs(drop_frames_path, exist_ok=True)
-
-    print(f"Generating frames for Drop {drop_no}...")
-
-    # Generate and save frames
-    for i, (_, row) in enumerate(group.iterrows()):
-        fig, ax = plt.subplots(figsize=(6, 6))
-
-        center_x = 0
-        center_y = 0
-        major_axis = row[major_col]
-        minor_axis = row[minor_col]
-        angle_deg = row[angle_col]
-
-        # Ellipse
-        ellipse = patches.Ellipse(
-            (center_x, center_y),
-            width=major_axis,
-            height=minor_axis,
-            angle=angle_deg,
-            edgecolor='darkblue',
-            facecolor='none',
-            linewidth=2
-        )
-        ax.add_patch(ellipse)
-
-        # Major axis
-        angle_rad = np.deg2rad(angle_deg)
-        dx_major = (major_axis / 2) * np.cos(angle_rad)
-        dy_major = (major_axis / 2) * np.sin(angle_rad)
-        ax.plot(
-            [center_x - dx_major, center_x + dx_major],
-            [center_y - dy_major, center_y + dy_major],
-            color='darkblue',
-            linewidth=1
-        )
-
-        # Minor axis
-        dx_minor = (minor_axis / 2) * np.cos(angle_rad + np.pi / 2)
-        dy_minor = (minor_axis / 2) * np.sin(angle_rad + np.pi / 2)
-        ax.plot(
-            [center_x - dx_minor, center_x + dx_minor],
-            [center_y - dy_minor, center_y + dy_minor],
-            color='darkblue',
-            linewidth=1
-        )
-
-        # Center point
-        ax.plot(center_x, center_y, 'ko', markersize=3)
-
-        # Time label
-        ax.set_title(f"Drop {drop_no} — t = {row['Reduced Time (s)']:.3f} s", fontsize=12)
-
-        ax.set_xlim(-3, 3)
-        ax.set_ylim(-3, 3)
-        ax.set_aspect('equal')
-        ax.axis('off')
-
-        frame_path = os.path.join(drop_frames_path, f"frame_{i:03d}.png")
-        plt.savefig(frame_path, dpi=100)
-        plt.close()
-
-    print(f"Creating video for Drop {drop_no}...")
-
-    # Compile video
+save_frames = False  # True also writes every frame as a PNG to frames_dir
+axis_limit = 3  # mm shown either side of the centre
+
+# Renderer: 'opencv' draws straight into a pixel buffer (fast), 'matplotlib' uses an Agg figure
+renderer = 'opencv'
+workers = os.cpu_count()  # Drops rendered in parallel, one video per process
+
+# One figure for every frame of every drop; artists are updated in place
+fig = Figure(figsize=(frame_width / 100, frame_height / 100), dpi=100)
+canvas = FigureCanvasAgg(fig)
+ax = fig.add_subplot()
+
+ellipse = patches.Ellipse((0, 0), width=0, height=0, angle=0, edgecolor='darkblue', facecolor='none', linewidth=2)
+ax.add_patch(ellipse)
+major_line, = ax.plot([], [], color='darkblue', linewidth=1)  # Major axis
+minor_line, = ax.plot([], [], color='darkblue', linewidth=1)  # Minor axis
+ax.plot(0, 0, 'ko', markersize=3)  # Center point
+title = ax.set_title('', fontsize=12)
+
+ax.set_xlim(-axis_limit, axis_limit)
+ax.set_ylim(-axis_limit, axis_limit)
+ax.set_aspect('equal')
+ax.axis('off')
+
+# Draw one ellipse (centred at the origin) and return the frame as a BGR image
+def render_frame(major_axis, minor_axis, angle_deg, drop_no, t):
+    ellipse.set_width(major_axis)
+    ellipse.set_height(minor_axis)
+    ellipse.set_angle(angle_deg)
+
+    angle_rad = np.deg2rad(angle_deg)
+    dx_major = (major_axis / 2) * np.cos(angle_rad)
+    dy_major = (major_axis / 2) * np.sin(angle_rad)
+    major_line.set_data([-dx_major, dx_major], [-dy_major, dy_major])
+
+    dx_minor = (minor_axis / 2) * np.cos(angle_rad + np.pi / 2)
+    dy_minor = (minor_axis / 2) * np.sin(angle_rad + np.pi / 2)
+    minor_line.set_data([-dx_minor, dx_minor], [-dy_minor, dy_minor])
+
+    # Time label
+    title.set_text(f"Drop {drop_no} — t = {t:.3f} s")
+
+    canvas.draw()
+    return cv2.cvtColor(np.asarray(canvas.buffer_rgba()), cv2.COLOR_RGBA2BGR)
+
+# OpenCV drawing: mm -> pixels with the centre in the middle of the frame and y pointing up.
+# The view spans the same share of the frame as the matplotlib axes, so both renderers give the same scale.
+view_fraction = 0.77
+px_per_mm = view_fraction * min(frame_width, frame_height) / (2 * axis_limit)
+shift = 4  # Sub-pixel bits for cv2 drawing
+one = 1 << shift
+cv_frame = np.empty((frame_height, frame_width, 3), np.uint8)  # Reused for every frame
+dark_blue = (139, 0, 0)  # BGR
+
+def to_px(x_mm, y_mm):
+    # Fixed-point pixel coordinates for cv2 calls made with shift
+    return (int(round((frame_width / 2 + x_mm * px_per_mm) * one)),
+            int(round((frame_height / 2 - y_mm * px_per_mm) * one)))
+
+# Same frame as render_frame(), drawn with cv2 only
+def render_frame_cv(major_axis, minor_axis, angle_deg, drop_no, t):
+    cv_frame[:] = 255
+
+    # Ellipse (image y points down, so the angle turns the other way)
+    axes = (int(round(major_axis / 2 * px_per_mm * one)), int(round(minor_axis / 2 * px_per_mm * one)))
+    cv2.ellipse(cv_frame, to_px(0, 0), axes, -angle_deg, 0, 360, dark_blue, 2, cv2.LINE_AA, shift)
+
+    # Major and minor axes
+    angle_rad = np.deg2rad(angle_deg)
+    for half, theta in ((major_axis / 2, angle_rad), (minor_axis / 2, angle_rad + np.pi / 2)):
+        dx, dy = half * np.cos(theta), half * np.sin(theta)
+        cv2.line(cv_frame, to_px(-dx, -dy), to_px(dx, dy), dark_blue, 1, cv2.LINE_AA, shift)
+
+    # Center point
+    cv2.circle(cv_frame, to_px(0, 0), 2 * one, (0, 0, 0), -1, cv2.LINE_AA, shift)
+
+    # Time label, centred at the top
+    label = f"Drop {drop_no} - t = {t:.3f} s"
+    (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)
+    cv2.putText(cv_frame, label, ((frame_width - text_w) // 2, 20 + text_h), cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                (0, 0, 0), 1, cv2.LINE_AA)
+    return cv_frame
+
+# Write one drop's video; rows are (major, minor, angle, reduced time) per frame
+def render_drop_video(drop_no, rows):
+    render = render_frame_cv if renderer == 'opencv' else render_frame
+
+    if save_frames:
+        drop_frames_path = os.path.join(frames_dir, f"drop_{drop_no}")
+        os.makedirs(drop_frames_path, exist_ok=True)
+
+    # Frames go straight into the video
     video_path = os.path.join(videos_dir, f"drop_{drop_no}_evolution.mp4")
-    frame_files = sorted([
-        os.path.join(drop_frames_path, f) for f in os.listdir(drop_frames_path)
-        if f.endswith(".png")
-    ])
+    out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
+
+    for i, (major_axis, minor_axis, angle_deg, t) in enumerate(rows):
+        frame = render(major_axis, minor_axis, angle_deg, drop_no, t)
+        out.write(frame)
+        if save_frames:
+            cv2.imwrite(os.path.join(drop_frames_path, f"frame_{i:03d}.png"), frame)
+
+    out.release()
+    print(f"Saved video for Drop {drop_no} at {video_path}")
+    return video_path
+
+
+if __name__ == "__main__":
+    df = read_results(file_path)
+    filtered_df = df[df[drop_col].between(drop_range[0], drop_range[1])].copy()
 
-    if frame_files:
-        # Read one image to get size
-        first_frame = cv2.imread(frame_files[0])
-        height, width, _ = first_frame.shape
-        out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    # Compute Reduced Time (time since each drop's first row, one grouped pass)
+    filtered_df["Reduced Time (s)"] = filtered_df[time_col] - filtered_df.groupby(drop_col)[time_col].transform('first')
 
-        for frame_file in frame_files:
-            img = cv2.imread(frame_file)
-            out.write(img)
+    os.makedirs(videos_dir, exist_ok=True)
 
-        out.release()
-        print(f"Saved video for Drop {drop_no} at {video_path}")
+    # One job per drop
+    jobs = [
+        (drop_no, group[[major_col, minor_col, angle_col, "Reduced Time (s)"]].to_numpy())
+        for drop_no, group in filtered_df.groupby(drop_col)
+    ]
+    print(f"Creating {len(jobs)} drop videos with the {renderer} renderer...")
+    run_batch(render_drop_video, jobs, workers)
 
-print("\n✅ All videos generated successfully!")
\ No newline at end of file
+    print("\n✅ All videos generated successfully!")
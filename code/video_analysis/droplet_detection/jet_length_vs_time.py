@@ -4,6 +4,9 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import os
 from Functions import crop
+from frame_sources import TIFF_EXTENSIONS, is_frame_source, open_video  # Also reads TIFF stacks and image folders directly
+from results_io import RESULT_FORMATS, write_results
+from processed_manifest import ProcessedManifest  # Skips videos already processed
 
 # Set base input and output folders
 input_base = r'Input folder path'
@@ -22,48 +25,68 @@ os.makedirs(histogram_folder, exist_ok=True)
 # Threshold and morphology settings
 threshold_value = 150  
 kernel = np.ones((5, 5), np.uint8)
+jet_roi = (0.47, 0, 0.1, 1)  # crop() fractions of the strip holding the jet, adjust if needed
+block_size = 256  # Frames analysed together by first_zero_rows()
+output_format = 'csv'  # or 'parquet'/'feather' for typed columns
+skip_processed = True  # Don't rerun videos whose file, outputs and settings are unchanged
 
 # Functions
-def get_row_intensity(binary_roi):
-    return np.mean(binary_roi, axis=1)
-
-def find_first_zero_row(row_intensities):
-    zero_rows = np.where(row_intensities == 0)[0]
-    return zero_rows[0] if zero_rows.size > 0 else -1
+def first_zero_rows(binary_block):
+    # binary_block is (frames, rows, cols); a row is zero when none of its pixels are set.
+    # Returns the first zero row of every frame, -1 where there is none.
+    zero_rows = ~binary_block.any(axis=2)
+    first = zero_rows.argmax(axis=1)
+    first[~zero_rows.any(axis=1)] = -1
+    return first
+
+def get_gray_roi(frame):
+    # Crop first so only the jet strip is converted and thresholded
+    roi = crop(frame, *jet_roi)
+    if roi.ndim == 2:
+        return roi
+    return cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
 
 def process_video(video_path, video_name_wo_ext):
-    cap = cv2.VideoCapture(video_path)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
-    zero_rows_per_frame = []
-    frame_numbers = []
-    frame_no = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, threshold_value, 255, cv2.THRESH_BINARY_INV)
-
-        roi = crop(binary, 0.47, 0, 0.1, 1)  # Adjust if needed
-        roi_filled = cv2.morphologyEx(roi, cv2.MORPH_CLOSE, kernel, iterations=2)
-
-        row_intensities = get_row_intensity(roi_filled)
-        first_zero_row = find_first_zero_row(row_intensities)
-
-        zero_rows_per_frame.append(first_zero_row)
-        frame_numbers.append(frame_no)
-
-        frame_no += 1
-
-    cap.release()
+    cap = open_video(video_path, gray=True)  # TIFF stacks and image folders come as grayscale
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+        zero_rows_per_frame = []
+        gray_block = filled_block = None
+        n = 0  # Frames waiting in the current block
+
+        while True:
+            ret, frame = cap.read()
+            if ret:
+                gray = get_gray_roi(frame)
+                if gray_block is None:
+                    gray_block = np.empty((block_size,) + gray.shape, np.uint8)
+                    filled_block = np.empty_like(gray_block)
+                gray_block[n] = gray
+                n += 1
+
+            # Analyse a full block, or what is left at the end of the video
+            if n and (n == block_size or not ret):
+                rows, cols = gray_block.shape[1:]
+                binary = gray_block[:n].reshape(n * rows, cols)
+                cv2.threshold(binary, threshold_value, 255, cv2.THRESH_BINARY_INV, dst=binary)
+                for i in range(n):
+                    cv2.morphologyEx(gray_block[i], cv2.MORPH_CLOSE, kernel, dst=filled_block[i], iterations=2)
+                zero_rows_per_frame.extend(first_zero_rows(filled_block[:n]).tolist())
+                n = 0
+
+            if not ret:
+                break
+    finally:
+        cap.release()
+    frame_numbers = list(range(len(zero_rows_per_frame)))
 
     # Save CSV
     df = pd.DataFrame({'Frame': frame_numbers, 'Jet Length (pixels)': zero_rows_per_frame})
-    csv_path = os.path.join(csv_folder, f'{video_name_wo_ext}_jet_length_data.csv')
-    df.to_csv(csv_path, index=False)
+    csv_path = os.path.join(csv_folder, f'{video_name_wo_ext}_jet_length_data{RESULT_FORMATS[output_format]}')
+    write_results(df, csv_path)
+    line_plot_path = os.path.join(line_plot_folder, f'{video_name_wo_ext}_jet_length_plot.png')
+    histogram_path = os.path.join(histogram_folder, f'{video_name_wo_ext}_jet_length_histogram.png')
     Frame_no=np.array(frame_numbers)/500
     Jet_l=np.array(zero_rows_per_frame)*96/1280
     # Plot line graph
@@ -74,7 +97,7 @@ def process_video(video_path, video_name_wo_ext):
     # plt.title(f"Jet Length vs Frame Number\n({video_name_wo_ext})")
     plt.grid(True)
     plt.tight_layout()
-    plt.savefig(os.path.join(line_plot_folder, f'{video_name_wo_ext}_jet_length_plot.png'))
+    plt.savefig(line_plot_path)
     plt.close()
 
     # Plot histogram
@@ -85,18 +108,31 @@ def process_video(video_path, video_name_wo_ext):
     # plt.title(f"Histogram of Jet Length\n({video_name_wo_ext})")
     plt.grid(True)
     plt.tight_layout()
-    plt.savefig(os.path.join(histogram_folder, f'{video_name_wo_ext}_jet_length_histogram.png'))
+    plt.savefig(histogram_path)
     plt.close()
 
+    return [csv_path, line_plot_path, histogram_path]
+
+# Record of processed videos and the settings they were processed with
+processed = ProcessedManifest(os.path.join(output_base, 'processed.json'), {
+    'threshold_value': threshold_value, 'kernel': kernel.shape, 'jet_roi': jet_roi, 'output_format': output_format,
+})
+
 # Walk through folders
 for root, dirs, files in os.walk(input_base):
-    for file in files:
-        if file.lower().endswith('.avi'):
-            input_path = os.path.join(root, file)
-            video_name_wo_ext = os.path.splitext(file)[0]
-
-            print(f"Processing: {input_path}")
-            process_video(input_path, video_name_wo_ext)
+    if is_frame_source(root):
+        sources = [(root, os.path.basename(os.path.normpath(root)))]  # A folder of image frames is one recording
+    else:
+        sources = [(os.path.join(root, file), os.path.splitext(file)[0]) for file in files
+                   if file.lower().endswith(('.avi',) + TIFF_EXTENSIONS)]
+    for input_path, video_name_wo_ext in sources:
+        if skip_processed and processed.is_current(input_path):
+            print(f"Skipping (already processed): {input_path}")
+            continue
+
+        print(f"Processing: {input_path}")
+        outputs = process_video(input_path, video_name_wo_ext)
+        processed.mark_done(input_path, outputs)
 
 print("✅ All videos processed. Outputs saved to:")
 print(f"📁 CSVs: {csv_folder}")
@@ -3,161 +3,225 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
-from Functions import crop  # Ensure you have the crop function defined in Functions.py
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, replace
+from droplet_engine import DetectionConfig, detect_drops, preview_due  # Ensure utils/ (Functions.py, droplet_engine.py) is importable
+from frame_sources import TIFF_EXTENSIONS, is_frame_source, open_video  # Prefetching reader; also reads TIFF stacks and image folders
+from results_io import RESULT_FORMATS
+from checkpoint import RunCheckpoint  # Periodic saves so an interrupted run can resume
+from processed_manifest import ProcessedManifest  # Skips videos already processed
+
+# Detection settings shared by every video
+default_config = DetectionConfig(
+    roi=(0.30, 0.5, 0.38, 0.48),  # Adjust ROI after rotation
+    line_position=60,
+    min_contour_area=100,
+    max_contour_area=750,
+    # rotate=cv2.ROTATE_90_CLOCKWISE,
+)
+
+# Results file and histogram written for one video
+def video_outputs(video_path, output_folder, output_format='csv'):
+    if os.path.isdir(video_path):
+        video_name = os.path.basename(os.path.normpath(video_path))  # Image folder: named after the folder
+    else:
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+    return (os.path.join(output_folder, f"{video_name}_results{RESULT_FORMATS[output_format]}"),
+            os.path.join(output_folder, f"{video_name}_radius_histogram.png"))
+
 
 # Function to process a single video
-def process_video(video_path, output_folder, scale=96, fps=500):
+def process_video(video_path, output_folder, scale=96, fps=500, config=default_config, preview_every=0, output_format='csv',
+                  checkpoint_every=1000, warmup_frames=2000):
+    # preview_every: 0 = headless (no GUI work at all), N = show every Nth frame
+    # output_format: 'csv', or 'parquet'/'feather' for typed full-precision columns
+    # checkpoint_every: save results and frame position every N frames (0 = never); a rerun
+    # after a crash or 'c' resumes there, re-warming the background model on warmup_frames frames
     video_name = os.path.splitext(os.path.basename(video_path))[0]  # Extract video name
+    config = replace(config, scale=scale, fps=fps)
 
     # Create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
 
     # Initialize video capture
-    rec = cv2.VideoCapture(video_path)
-    rec.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
-    obj_det = cv2.createBackgroundSubtractorMOG2(varThreshold=16)  # Background subtraction
-
-    all_radii = []  
-    drop_count = 0  
-    frame_no = 0
-    cross_time = []
-    coordinates_and_time = []
+    rec = open_video(video_path)
+    try:
+        if not rec.isOpened():
+            raise IOError(f"Could not open video {video_path}")
+
+        results_path, radius_hist_path = video_outputs(video_path, output_folder, output_format)
+        checkpoint = RunCheckpoint(results_path, config, checkpoint_every)
+        records = checkpoint.records  # Every accepted drop: frame, time, position, radius, track, crossing
+        drop_count = checkpoint.counters.get('drop_count', 0)
+        ratio = 0
     
-    paused = False  
-
-    line_position = 60  
-    min_contour_area = 100  
-    max_contour_area = 750  
-    previous_centroids = []  
-
-    while True:
-        if not paused:  
-            ret, frame = rec.read()
-            if not ret:  
-                break
-
-            frame_no += 1
-
-            # Rotate the frame 90 degrees clockwise
-            # frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+        paused = False  
 
-            # Adjust the scale ratio
-            ratio = scale / int(rec.get(4))  
-
-            # Adjust ROI after rotation
-            roi = crop(frame, 0.30, 0.5, 0.38, 0.48)  
-
-            mask = obj_det.apply(roi)  
-
-            # Apply manual thresholding
-            _, mask = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY)
-
-            # Apply morphological operations
-            kernel = np.ones((3, 3), np.uint8)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-
-            # Find contours
-            contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        detections = detect_drops(rec, config, checkpoint.start_frame(), warmup_frames=warmup_frames if checkpoint.resumed else 0,
+                                  tracker=checkpoint.tracker)
+        for det in detections:
+            ratio = det.ratio
+            frame, roi = det.frame, det.roi
+            show = preview_due(det, preview_every)
 
+            drop_count += det.crossings
             total_area = 0
-            radii = []
-            current_centroids = []  
-
-            for cnt in contours:
-                area = cv2.contourArea(cnt)
-
-                if min_contour_area < area < max_contour_area:  
-                    M = cv2.moments(cnt)
-                    if M['m00'] != 0:  
-                        cx = int(M['m10'] / M['m00'])  
-                        cy = int(M['m01'] / M['m00'])  
 
-                        current_centroids.append((cx, cy))
+            for drop in det.drops:
+                total_area += drop.area
+                records.add_drop(det, drop)
 
-                        for (prev_cx, prev_cy) in previous_centroids:
-                            if prev_cy < line_position <= cy:  
-                                drop_count += 1
-                                cross_time.append(frame_no / fps)
-                                break
+                if show:
+                    # Draw contours on the ROI and a line at detected drop location
+                    cv2.drawContours(roi, [drop.contour], -1, (8, 255, 0), -1)
+                    cv2.line(roi, (0, drop.cy), (roi.shape[1], drop.cy), (0, 0, 255), 2)
+                    cv2.putText(frame, f'Dis. : {drop.cy*ratio:.2f} mm', (10, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
-                    # Draw contours on the ROI
-                    cv2.drawContours(roi, [cnt], -1, (8, 255, 0), -1)
-                    total_area += area
+            if checkpoint.due(det.frame_no):
+                checkpoint.save(det.frame_no, drop_count=drop_count)
 
-                    # Calculate radius
-                    radius = np.sqrt(area / np.pi)
-                    radii.append(radius)
-                    all_radii.append(radius)  
-                    coordinates_and_time.append([cy * ratio, frame_no / fps, radius * ratio])
+            if not show:
+                continue
 
-                    # Draw a line at detected drop location
-                    cv2.line(roi, (0, cy), (roi.shape[1], cy), (0, 0, 255), 2)
-                    cv2.putText(frame, f'Dis. : {cy*ratio:.2f} mm', (10, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-            previous_centroids = current_centroids
-
-            avg_radius = np.mean(radii) if radii else 0
+            avg_radius = np.mean([drop.radius for drop in det.drops]) if det.drops else 0
 
             # Draw counting line
-            cv2.line(roi, (0, line_position), (roi.shape[1], line_position), (0, 0, 255), 2)
+            cv2.line(roi, (0, config.line_position), (roi.shape[1], config.line_position), (0, 0, 255), 2)
 
             # Display text on video
             cv2.putText(frame, f'Total Area: {total_area}', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
             cv2.putText(frame, f'Avg Radius: {avg_radius:.2f} mm', (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
             cv2.putText(frame, f'Drop Count: {drop_count}', (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            cv2.putText(frame, f'Frame No.: {frame_no}', (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-        frame_resized = cv2.resize(frame, (400, 600))
-
-        cv2.imshow(video_name, frame_resized)
-        cv2.imshow('Processed Mask', mask)
-        cv2.imshow('ROI', roi)
-
-        key = cv2.waitKey(1) & 0xFF  
-        if key == ord('c'):  
-            break
-        elif key == ord('p'):  
-            paused = not paused  
-
-    rec.release()
-    cv2.destroyAllWindows()  
-
-    # Scaling radii
-    all_radii_scaled = np.array(all_radii) * ratio
-
-    # Save CSV
-    csv_file_path = os.path.join(output_folder, f"{video_name}_results.csv")
-    df = pd.DataFrame(coordinates_and_time, columns=['Y-coordinate(mm)', 'Time(Sec)', 'Radius(mm)'])
-    df.to_csv(csv_file_path, index=False, float_format='%.4f')
+            cv2.putText(frame, f'Frame No.: {det.frame_no}', (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+            frame_resized = cv2.resize(frame, (400, 600))
+
+            cv2.imshow(video_name, frame_resized)
+            cv2.imshow('Processed Mask', det.mask)
+            cv2.imshow('ROI', roi)
+
+            key = cv2.waitKey(1) & 0xFF  
+            if key == ord('p'):  
+                paused = True
+                while paused and key != ord('c'):
+                    key = cv2.waitKey(1) & 0xFF
+                    if key == ord('p'):
+                        paused = False
+            if key == ord('c'):  
+                checkpoint.stop(det.frame_no, drop_count=drop_count)
+                break
+    finally:
+        rec.release()  # Also stops the decode thread when detection fails
+    if preview_every:
+        cv2.destroyAllWindows()  
+
+    # Save results, block by block
+    records.write_results(results_path, {'y': 'Y-coordinate(mm)', 'time': 'Time(Sec)', 'radius': 'Radius(mm)'})
+    record_count = len(records)
+
+    # Radius histogram, also built block by block (radii are already scaled to mm)
+    counts, edges = records.histogram('radius', bins=100)
+    mean_radius = records.mean('radius')
+    if checkpoint.stopped:
+        print(f"Stopped {video_path} at frame {checkpoint.frame_no}; run again to resume")
+    else:
+        checkpoint.finish()
 
     print(f"Processed {video_path}")
-    print(f"Results saved at {csv_file_path}")
+    print(f"Results saved at {results_path}")
 
     # Save Histogram
     plt.figure()
-    plt.hist(all_radii_scaled, bins=100, density=True, alpha=0.6, color='g')
+    plt.hist(edges[:-1], edges, weights=counts, density=True, alpha=0.6, color='g')
     plt.xlabel('Drop Radius (mm)')
     plt.ylabel('Density')
     plt.title('Histogram of Drop Radii')
-    plt.axvline(x=np.mean(all_radii_scaled), color='r', linestyle='-')
-    radius_hist_path = os.path.join(output_folder, f"{video_name}_radius_histogram.png")
+    plt.axvline(x=mean_radius, color='r', linestyle='-')
     plt.savefig(radius_hist_path)
     plt.close()
 
+    return drop_count, record_count
+
+
+# Worker setup: no GUI backend, and one OpenCV thread per process so workers don't oversubscribe cores
+def init_worker():
+    plt.switch_backend('Agg')
+    cv2.setNumThreads(1)
+
+
+# Function to process one video and report the outcome instead of raising
+def run_video_job(video_path, output_folder, output_format='csv'):
+    start = time.perf_counter()
+    row = {'Video': video_path, 'Status': 'ok', 'Drop Count': 0, 'Detections': 0, 'Error': ''}
+    try:
+        row['Drop Count'], row['Detections'] = process_video(video_path=video_path, output_folder=output_folder, output_format=output_format)
+    except Exception as e:
+        row['Status'] = 'failed'
+        row['Error'] = f"{type(e).__name__}: {e}"
+        print(f"Failed {video_path}: {row['Error']}")
+    row['Wall Time (s)'] = time.perf_counter() - start
+    return row
+
 
 # Function to process videos in folders
-def process_videos_in_folders(input_folder):
+# workers > 1 spreads the videos over a process pool; each video gets its own
+# background subtractor, CSV and histogram. A manifest.csv summarising every
+# video is written to the results folder either way.
+# skip_processed: videos listed in processed.json in the results folder whose file,
+# outputs and detection settings are unchanged are not run again
+def process_videos_in_folders(input_folder, workers=1, output_format='csv', skip_processed=True):
+    results_folder = input_folder + "_results"
+    processed = ProcessedManifest(os.path.join(results_folder, "processed.json"),
+                                  {'config': asdict(default_config), 'output_format': output_format})
+    jobs = []
+    skipped = []
     for root_dir, sub_dirs, files in os.walk(input_folder):
-        for file in files:
-            if file.endswith(".avi"):  
-                video_path = os.path.join(root_dir, file)
-                relative_path = os.path.relpath(root_dir, input_folder)
-                output_folder = os.path.join(input_folder + "_results", relative_path)
-                process_video(video_path=video_path, output_folder=output_folder)
+        if is_frame_source(root_dir):
+            video_paths = [root_dir]  # A folder of image frames is one recording
+        else:
+            # TIFF stacks need no conversion
+            video_paths = [os.path.join(root_dir, file) for file in files
+                           if file.endswith(".avi") or file.lower().endswith(TIFF_EXTENSIONS)]
+        for video_path in video_paths:
+            relative_path = os.path.relpath(root_dir, input_folder)
+            output_folder = os.path.join(results_folder, relative_path)
+            if skip_processed and processed.is_current(video_path):
+                skipped.append({'Video': video_path, 'Status': 'skipped', **processed.info(video_path),
+                                'Wall Time (s)': 0, 'Error': ''})
+                continue
+            jobs.append((video_path, output_folder, output_format))
+    if skipped:
+        print(f"Skipping {len(skipped)} videos already processed")
+
+    # Record each finished video straight away, so an interrupted batch keeps its progress
+    def finished(row, job):
+        if row['Status'] == 'ok':
+            processed.mark_done(job[0], video_outputs(*job), **{key: row[key] for key in ('Drop Count', 'Detections')})
+        return row
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            futures = {pool.submit(run_video_job, *job): i for i, job in enumerate(jobs)}
+            rows = {}
+            for future in as_completed(futures):  # In the order the videos finish
+                i = futures[future]
+                rows[i] = finished(future.result(), jobs[i])
+            manifest = [rows[i] for i in range(len(jobs))]  # Back in job order
+    else:
+        manifest = [finished(run_video_job(*job), job) for job in jobs]
+    manifest = skipped + manifest
+
+    os.makedirs(results_folder, exist_ok=True)
+    manifest_path = os.path.join(results_folder, "manifest.csv")
+    pd.DataFrame(manifest, columns=['Video', 'Status', 'Drop Count', 'Detections', 'Wall Time (s)', 'Error']).to_csv(
+        manifest_path, index=False, float_format='%.2f')
+
+    failed = sum(row['Status'] == 'failed' for row in manifest)
+    print(f"{len(manifest) - failed}/{len(manifest)} videos processed, manifest saved at {manifest_path}")
+    return manifest
 
 # Main execution
 if __name__ == "__main__":
     input_folder_path = r"Input folder path"  
-    process_videos_in_folders(input_folder=input_folder_path)
+    process_videos_in_folders(input_folder=input_folder_path, workers=os.cpu_count())